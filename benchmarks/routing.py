@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark suite for :class:`webapp2.Router`.
+
+Builds synthetic route tables of increasing size, mixing static routes,
+routes with variables, :class:`webapp2_extras.routes.PathPrefixRoute`,
+:class:`webapp2_extras.routes.DomainRoute` and routes restricted to some
+HTTP methods, and measures for each matcher:
+
+- ``setup``: creating the router.
+- ``hit_first``, ``hit_middle``, ``hit_last``: matching routes at different
+  positions in the table.
+- ``prefix`` and ``domain``: matching routes nested in prefix and domain
+  routes.
+- ``not_found`` and ``method_not_allowed``: 404 and 405 misses.
+- ``build``: building a URI, as :func:`webapp2.uri_for` does.
+
+Results are written as JSON, to compare releases::
+
+    python -m benchmarks.routing --output results.json
+    python -m benchmarks.routing --sizes 10 100 --matchers default_matcher
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+import webapp2
+from webapp2_extras import routes
+
+SIZES = [10, 100, 1000, 10000]
+MATCHERS = ['default_matcher', 'trie_matcher', 'combined_matcher']
+#: Kinds of routes, repeated in this order to fill the table.
+KINDS = ['static', 'variable', 'prefix', 'domain', 'method']
+
+
+def get_routes(size):
+    """Returns a list with `size` routes, and the number of each kind."""
+    rv = []
+    for i in range(size):
+        kind = KINDS[i % len(KINDS)]
+        if kind == 'static':
+            route = webapp2.Route('/static%d/page' % i, None, 'static%d' % i)
+        elif kind == 'variable':
+            route = webapp2.Route('/items%d/<id:\\d+>/<slug>' % i, None,
+                                  'variable%d' % i)
+        elif kind == 'prefix':
+            route = routes.PathPrefixRoute('/prefix%d' % i, [
+                webapp2.Route('/', None, 'prefix%d-index' % i),
+                webapp2.Route('/<name>', None, 'prefix%d' % i),
+            ])
+        elif kind == 'domain':
+            route = routes.DomainRoute('<sub>.tenant%d.example.com' % i, [
+                webapp2.Route('/dashboard', None, 'domain%d' % i),
+            ])
+        else:
+            route = webapp2.Route('/api%d/<id>' % i, None, 'method%d' % i,
+                                  methods=['POST'])
+
+        rv.append(route)
+
+    return rv
+
+
+def get_index(size, kind, position):
+    """Returns the index of a route of a kind near a relative position."""
+    index = int((size - 1) * position)
+    index -= (index - KINDS.index(kind)) % len(KINDS)
+    if index < 0:
+        index += len(KINDS)
+
+    return index
+
+
+def get_request(path, host='localhost', method='GET'):
+    request = webapp2.Request.blank(path, base_url='http://%s' % host)
+    request.method = method
+    return request
+
+
+def get_scenarios(size):
+    """Returns a list of tuples ``(name, function)`` to be timed for a
+    table of `size` routes.
+    """
+    def match(request):
+        def func(router):
+            try:
+                router.match(request)
+            except (webapp2.exc.HTTPNotFound,
+                    webapp2.exc.HTTPMethodNotAllowed):
+                pass
+
+        return func
+
+    def variable(position):
+        i = get_index(size, 'variable', position)
+        return match(get_request('/items%d/42/some-slug' % i))
+
+    prefix = get_index(size, 'prefix', 1)
+    domain = get_index(size, 'domain', 1)
+    method = get_index(size, 'method', 1)
+    build = get_index(size, 'variable', 1)
+    build_request = get_request('/')
+
+    def build_uri(router):
+        router.build(build_request, 'variable%d' % build, (),
+                     {'id': '42', 'slug': 'some-slug'})
+
+    return [
+        ('hit_first', variable(0)),
+        ('hit_middle', variable(0.5)),
+        ('hit_last', variable(1)),
+        ('prefix', match(get_request('/prefix%d/foo' % prefix))),
+        ('domain', match(get_request(
+            '/dashboard', host='www.tenant%d.example.com' % domain))),
+        ('not_found', match(get_request('/not/found'))),
+        ('method_not_allowed', match(get_request('/api%d/1' % method))),
+        ('build', build_uri),
+    ]
+
+
+def get_router(size, matcher):
+    router = webapp2.Router(get_routes(size))
+    router.set_matcher(getattr(webapp2.Router, matcher))
+    return router
+
+
+def measure(func, number, repeat):
+    """Returns the best time of `func` in microseconds."""
+    seconds = min(timeit.repeat(func, number=number, repeat=repeat))
+    return seconds / number * 1e6
+
+
+def run(sizes, matchers, number=None, repeat=3):
+    """Runs the benchmarks and returns a list of result dictionaries."""
+    results = []
+    for size in sizes:
+        # Fewer iterations for larger tables, so each run takes similar time.
+        iterations = number or max(10, 10000 // size)
+        scenarios = get_scenarios(size)
+        for matcher in matchers:
+            router = get_router(size, matcher)
+            # Build the lazy state before timing.
+            router.compile()
+            for name, func in scenarios:
+                func(router)
+
+            results.append({
+                'size': size,
+                'matcher': matcher,
+                'scenario': 'setup',
+                'usec': measure(lambda: get_router(size, matcher),
+                                max(1, iterations // 10), repeat),
+            })
+            for name, func in scenarios:
+                results.append({
+                    'size': size,
+                    'matcher': matcher,
+                    'scenario': name,
+                    'usec': measure(lambda: func(router), iterations,
+                                    repeat),
+                })
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='number of routes in each table')
+    parser.add_argument('--matchers', nargs='+', default=MATCHERS,
+                        choices=MATCHERS, help='Router matchers to use')
+    parser.add_argument('--number', type=int,
+                        help='iterations per measurement')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='measurements per benchmark; the best is kept')
+    parser.add_argument('--output', help='file to write; default is stdout')
+    args = parser.parse_args(argv)
+
+    report = {
+        'webapp2': webapp2.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'results': run(args.sizes, args.matchers, args.number, args.repeat),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
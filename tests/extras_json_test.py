@@ -29,6 +29,14 @@ class TestJson(unittest.TestCase):
             '"<script>alert(\\"hello\\")<\\/script>"'),
             '<script>alert("hello")</script>')
 
+    def test_decode_bytes(self):
+        self.assertEqual(json.decode(b'{"caf\xc3\xa9": [1, 2]}'),
+                         {u'caf\xe9': [1, 2]})
+        self.assertRaises(ValueError, json.decode, b'{"a": \xff}')
+        # Other encodings are not detected.
+        self.assertRaises(ValueError, json.decode,
+                          u'[1]'.encode('utf-16'))
+
     def test_b64encode(self):
         self.assertEqual(json.b64encode(
             '<script>alert("hello")</script>'),
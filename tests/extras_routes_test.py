@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
 import unittest
 
 from tests.test_base import BaseTestCase
@@ -24,6 +25,11 @@ from webapp2_extras.routes import NamePrefixRoute
 from webapp2_extras.routes import PathPrefixRoute
 from webapp2_extras.routes import RedirectRoute
 
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
 
 class HomeHandler(webapp2.RequestHandler):
     def get(self, **kwargs):
@@ -137,6 +143,75 @@ class TestRedirectRoute(BaseTestCase):
                           RedirectRoute, '/strict-bar/',
                           handler=HomeHandler, strict_slash=True)
 
+    def test_strict_slash_single_route(self):
+        route = RedirectRoute(r'/users/<id:\d+>/', HomeHandler, 'user',
+                              strict_slash=True, methods=['GET'])
+        edit = RedirectRoute(r'/users/<id:\d+>/edit', HomeHandler, 'edit',
+                             strict_slash=True)
+        router = webapp2.Router([route, edit])
+        self.assertEqual(router.match_routes, (route, edit))
+
+        req = webapp2.Request.blank('/users/1/')
+        self.assertEqual(router.match(req), (route, (), {'id': '1'}))
+        req = webapp2.Request.blank('/users/1/edit')
+        self.assertEqual(router.match(req), (edit, (), {'id': '1'}))
+
+        req = webapp2.Request.blank('/users/1')
+        match = router.match(req)
+        self.assertEqual(match[0].handler, webapp2.RedirectHandler)
+        self.assertEqual(match[0].template, r'/users/<id:\d+>')
+        self.assertEqual(match[2]['id'], '1')
+        self.assertEqual(match[2]['_name'], 'user')
+        # The redirect route is created once.
+        self.assertTrue(router.match(req)[0] is match[0])
+
+        req.method = 'POST'
+        self.assertEqual(router.match(req)[0], match[0])
+        req = webapp2.Request.blank('/users/1/')
+        req.method = 'POST'
+        self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+
+        req = webapp2.Request.blank('/users/1/edit/')
+        match = router.match(req)
+        self.assertEqual(match[0].handler, webapp2.RedirectHandler)
+        self.assertEqual(match[0].template, r'/users/<id:\d+>/edit/')
+
+        rsp = webapp2.Request.blank('/users/1/edit/').get_response(
+            webapp2.WSGIApplication([route, edit]))
+        self.assertEqual(rsp.status_int, 301)
+        self.assertEqual(rsp.headers['Location'],
+                         'http://localhost/users/1/edit')
+
+    def test_strict_slash_any_path(self):
+        # The last variable can match a slash, so a separate route is used.
+        route = RedirectRoute('/files/<path:.*>/', HomeHandler, 'files',
+                              strict_slash=True)
+        router = webapp2.Router([route])
+        self.assertEqual(len(router.match_routes), 2)
+
+        req = webapp2.Request.blank('/files/a/b/')
+        self.assertEqual(router.match(req), (route, (), {'path': 'a/b'}))
+        req = webapp2.Request.blank('/files/a/b')
+        self.assertEqual(router.match(req)[0].handler,
+                         webapp2.RedirectHandler)
+
+    def test_redirect_route_index(self):
+        plain = RedirectRoute('/plain', HomeHandler)
+        foo = RedirectRoute('/foo', HomeHandler, 'foo', strict_slash=True)
+        user = RedirectRoute(r'/users/<id:\d+>', HomeHandler, 'user',
+                             strict_slash=True)
+        router = webapp2.Router([plain, foo, user])
+        # Only the route matched with or without the slash is not indexed.
+        self.assertEqual(sorted(router._index.static),
+                         ['/foo', '/foo/', '/plain'])
+        self.assertEqual(len(router._index.dynamic), 1)
+
+        req = webapp2.Request.blank('/foo/')
+        self.assertEqual(router.match(req)[0].handler,
+                         webapp2.RedirectHandler)
+        req = webapp2.Request.blank('/plain')
+        self.assertEqual(router.match(req), (plain, (), {}))
+
     def test_build_only(self):
         self.assertRaises(ValueError,
                           RedirectRoute, '/',
@@ -265,6 +340,98 @@ class TestPrefixRoutes(BaseTestCase):
             path
         )
 
+    def test_path_prefix_match_path(self):
+        class LowerPrefixRoute(PathPrefixRoute):
+            def get_match_path(self, request):
+                return super(LowerPrefixRoute, self).get_match_path(
+                    request).lower()
+
+        route = webapp2.Route('/<name>', None)
+        router = webapp2.Router([LowerPrefixRoute('/users', [route])])
+        match = router.match(webapp2.Request.blank('/USERS/BOB'))
+        self.assertEqual(match[2], {'name': 'bob'})
+
+    def test_path_prefix_suffix(self):
+        leaf = webapp2.Route(r'/<:\d+>/<name>', None, 'leaf',
+                             defaults={'foo': 'bar'})
+        post = webapp2.Route('/post', None, 'post', methods=['POST'])
+        inner = PathPrefixRoute(r'/<:\d+>', [leaf, post])
+        outer = PathPrefixRoute(r'/users/<user:\w+>', [inner])
+        router = webapp2.Router([outer])
+        self.assertTrue(outer.splits_path)
+
+        req = webapp2.Request.blank('/users/calvin/1/2/hobbes')
+        self.assertEqual(router.match(req), (leaf, ('1', '2'), {
+            'user': 'calvin', 'name': 'hobbes', 'foo': 'bar'}))
+        # Nested routes only match the path after the prefixes.
+        self.assertTrue('regex' not in leaf.__dict__)
+        self.assertEqual(inner.prefix_children[0].template,
+                         r'/<:\d+>/<name>')
+        self.assertEqual(leaf.template,
+                         r'/users/<user:\w+>/<:\d+>/<:\d+>/<name>')
+        self.assertEqual(router.build(req, 'leaf', ('1', '2'), {
+            'user': 'calvin', 'name': 'hobbes'}), '/users/calvin/1/2/hobbes')
+
+        req = webapp2.Request.blank('/users/calvin/1/post')
+        self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+        req.method = 'POST'
+        self.assertEqual(router.match(req),
+                         (post, ('1',), {'user': 'calvin'}))
+
+        req = webapp2.Request.blank('/users/calvin/a/post')
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match, req)
+
+    def test_path_prefix_trailing_newline(self):
+        # As in the full template, "$" matches before a trailing newline.
+        leaf = webapp2.Route('/<n:[^/]+>', None)
+        inner = webapp2.Route('/b/<n:[^/]+>', None)
+        router = webapp2.Router([
+            PathPrefixRoute('/a', [leaf]),
+            PathPrefixRoute('/x', [PathPrefixRoute('/y', [inner])]),
+        ])
+        self.assertEqual(router.match(webapp2.Request.blank('/a/%0A')),
+                         (leaf, (), {'n': '\n'}))
+        self.assertEqual(router.match(webapp2.Request.blank('/a/b%0A')),
+                         (leaf, (), {'n': 'b\n'}))
+        self.assertEqual(router.match(webapp2.Request.blank('/x/y/b/c%0A')),
+                         (inner, (), {'n': 'c\n'}))
+
+    def test_path_prefix_full_path(self):
+        # A prefix variable that may match slashes can't split the path.
+        leaf = webapp2.Route(r'/<:\d+>/edit', None)
+        route = PathPrefixRoute('/files/<path:.+>', [leaf])
+        router = webapp2.Router([route])
+        self.assertFalse(route.splits_path)
+
+        req = webapp2.Request.blank('/files/a/1/b/2/edit')
+        self.assertEqual(router.match(req),
+                         (leaf, ('2',), {'path': 'a/1/b'}))
+
+    def test_path_prefix_converters(self):
+        leaf = webapp2.Route('/<post_id:int>', None, 'post')
+        route = PathPrefixRoute('/users/<user_id:int>', [leaf])
+        router = webapp2.Router([route])
+        self.assertFalse(route.splits_path)
+
+        req = webapp2.Request.blank('/users/7/42')
+        self.assertEqual(router.match(req)[1:],
+                         ((), {'user_id': 7, 'post_id': 42}))
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          webapp2.Request.blank('/users/foo/42'))
+        self.assertEqual(router.build(req, 'post', (),
+                                      {'user_id': 7, 'post_id': 42}),
+                         '/users/7/42')
+
+        # Converters in nested routes are applied to the path suffix.
+        leaf = webapp2.Route('/<post_id:int>', None)
+        route = PathPrefixRoute('/users', [leaf])
+        router = webapp2.Router([route])
+        self.assertTrue(route.splits_path)
+        self.assertEqual(router.match(webapp2.Request.blank('/users/42')),
+                         (leaf, (), {'post_id': 42}))
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          webapp2.Request.blank('/users/foo'))
+
 
 class TestDomainRoute(BaseTestCase):
     def test_simple(self):
@@ -359,6 +526,71 @@ class TestDomainRoute(BaseTestCase):
             path
         )
 
+    def test_host_index(self):
+        www = webapp2.Route('/', None, 'www')
+        tenant = webapp2.Route('/', None, 'tenant')
+        other = webapp2.Route('/', None, 'other')
+        post = webapp2.Route('/post', None, 'post', methods=['POST'])
+        router = webapp2.Router([
+            DomainRoute('www.example.com', [www]),
+            DomainRoute('<tenant>.example.com', [tenant, post]),
+            DomainRoute(r'<name:\w+>.example.org', [other]),
+            DomainRoute('<:.*>.example.net', [other]),
+        ])
+        self.assertEqual(router.match_routes[0].get_host_key(),
+                         ('www.example.com', False))
+        self.assertEqual(router.match_routes[1].get_host_key(),
+                         ('.example.com', True))
+        self.assertEqual(router.match_routes[3].get_host_key(), None)
+        # The first three routes share one entry of the index.
+        self.assertEqual(len(router._index.dynamic), 2)
+
+        def match(url):
+            return router.match(webapp2.Request.blank(url))
+
+        self.assertEqual(match('http://www.example.com/'), (www, (), {}))
+        self.assertEqual(match('http://acme.example.com/'),
+                         (tenant, (), {'tenant': 'acme'}))
+        self.assertEqual(match('http://acme.example.org/'),
+                         (other, (), {'name': 'acme'}))
+        self.assertEqual(match('http://a.b.example.net/'), (other, (), {}))
+        self.assertRaises(webapp2.exc.HTTPNotFound, match,
+                          'http://a.b.example.com/')
+        self.assertRaises(webapp2.exc.HTTPNotFound, match,
+                          'http://example.com/')
+        self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, match,
+                          'http://acme.example.com/post')
+
+        with mock.patch.object(DomainRoute, 'match', autospec=True,
+                               side_effect=DomainRoute.match) as patched:
+            match('http://acme.example.com/')
+            # Only the route for the host is tried.
+            patched.assert_called_once_with(router.match_routes[1], mock.ANY)
+
+    def test_host_index_hits(self):
+        www = DomainRoute('www.example.com', [webapp2.Route('/', None)])
+        tenant = DomainRoute('<tenant>.example.com',
+                             [webapp2.Route('/', None)])
+        router = webapp2.Router([www, tenant])
+        router.reorder_interval = 10
+        router.match(webapp2.Request.blank('http://acme.example.com/'))
+        # The host route is counted, not the group in the index.
+        self.assertEqual(router.match_order_info(), [(www, 0), (tenant, 1)])
+        self.assertEqual(list(router._hits), [tenant])
+
+    def test_host_index_regex_override(self):
+        class CIDomainRoute(DomainRoute):
+            @webapp2.cached_property
+            def regex(self):
+                return re.compile(DomainRoute.regex.func(self).pattern, re.I)
+
+        www = webapp2.Route('/', None, 'www')
+        route = CIDomainRoute('www.example.com', [www])
+        self.assertEqual(route.get_host_key(), None)
+        router = webapp2.Router([route])
+        req = webapp2.Request.blank('http://WWW.Example.com/')
+        self.assertEqual(router.match(req), (www, (), {}))
+
     def test_guide_examples(self):
         router = webapp2.Router([
             DomainRoute(r'www.mydomain.com', [
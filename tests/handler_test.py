@@ -18,8 +18,12 @@ Tests for webapp2 webapp2.RequestHandler
 """
 import os
 import sys
+import threading
+import time
 import unittest
+import zlib
 
+import six
 from six.moves.urllib.parse import unquote_plus
 
 from tests.test_base import BaseTestCase
@@ -218,6 +222,244 @@ class TestHandler(BaseTestCase):
         self.assertEqual(rsp.status_int, 405)
         self.assertEqual(rsp.headers.get('Allow'), 'GET, POST')
 
+    def test_405_without_handler(self):
+        class Handler(webapp2.RequestHandler):
+            def get(self):
+                self.response.write('get')
+
+            def put(self):
+                self.response.write('put')
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/', Handler),
+            webapp2.Route('/custom', Handler, handler_method='get'),
+        ])
+        with mock.patch.object(webapp2.RequestHandler, 'initialize',
+                               autospec=True,
+                               side_effect=webapp2.RequestHandler.initialize
+                               ) as initialize:
+            for method in ('POST', 'OPTIONS'):
+                req = webapp2.Request.blank('/')
+                req.method = method
+                rsp = req.get_response(app)
+                self.assertEqual(rsp.status_int, 405)
+                self.assertEqual(rsp.headers.get('Allow'), 'GET, PUT')
+
+            self.assertEqual(initialize.call_count, 0)
+            adapter = app.router.match_routes[0].handler_adapter
+            self.assertEqual(adapter.methods, frozenset(['GET', 'PUT']))
+
+            req = webapp2.Request.blank('/')
+            req.method = 'PUT'
+            self.assertEqual(req.get_response(app).body, b'put')
+            # A handler method is called for any request method.
+            req = webapp2.Request.blank('/custom')
+            req.method = 'POST'
+            self.assertEqual(req.get_response(app).body, b'get')
+            self.assertEqual(initialize.call_count, 2)
+
+    def test_405_custom_init(self):
+        instances = []
+
+        class InitHandler(webapp2.RequestHandler):
+            def __init__(self, *args, **kwargs):
+                instances.append(self)
+                super(InitHandler, self).__init__(*args, **kwargs)
+
+            def get(self):
+                pass
+
+        class InitializeHandler(webapp2.RequestHandler):
+            def initialize(self, request, response):
+                instances.append(self)
+                super(InitializeHandler, self).initialize(request, response)
+
+            def get(self):
+                pass
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/init', InitHandler),
+            webapp2.Route('/initialize', InitializeHandler),
+        ])
+        # Handlers that set themselves up are constructed for any method.
+        for path in ('/init', '/initialize'):
+            for method in ('POST', 'OPTIONS'):
+                req = webapp2.Request.blank(path)
+                req.method = method
+                rsp = req.get_response(app)
+                self.assertEqual(rsp.status_int, 405)
+                self.assertEqual(rsp.headers.get('Allow'), 'GET')
+
+        self.assertEqual([type(handler) for handler in instances],
+                         [InitHandler, InitHandler, InitializeHandler,
+                          InitializeHandler])
+
+    def test_405_custom_dispatch(self):
+        class DispatchHandler(webapp2.RequestHandler):
+            def dispatch(self):
+                self.response.write(self.request.method)
+
+        class PropfindHandler(webapp2.RequestHandler):
+            def propfind(self):
+                self.response.write('propfind')
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/', DispatchHandler),
+            webapp2.Route('/propfind', PropfindHandler),
+        ])
+        app.allowed_methods = app.allowed_methods | set(['PROPFIND'])
+        # Handlers are adapted outside a request.
+        app.warmup()
+
+        for method in ('GET', 'PUT'):
+            req = webapp2.Request.blank('/')
+            req.method = method
+            rsp = req.get_response(app)
+            self.assertEqual(rsp.status_int, 200)
+            self.assertEqual(rsp.body, method.encode('ascii'))
+
+        req = webapp2.Request.blank('/propfind')
+        req.method = 'PROPFIND'
+        self.assertEqual(req.get_response(app).body, b'propfind')
+        req.method = 'GET'
+        rsp = req.get_response(app)
+        self.assertEqual(rsp.status_int, 405)
+        self.assertEqual(rsp.headers.get('Allow'), 'PROPFIND')
+
+    def test_request_limits(self):
+        class Handler(webapp2.RequestHandler):
+            def post(self):
+                self.response.write(','.join(self.request.arguments()))
+
+        class PartsHandler(webapp2.RequestHandler):
+            def post(self):
+                for part in self.request.iter_parts():
+                    self.response.write(part.read())
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/', Handler),
+            webapp2.Route('/big', Handler, limits={'max_body_size': 100}),
+            webapp2.Route('/parts', PartsHandler),
+        ])
+        app.limits = {'max_body_size': 10, 'max_form_fields': 2}
+
+        def post(path, body, **environ):
+            environ.setdefault('CONTENT_LENGTH', str(len(body)))
+            environ.setdefault('CONTENT_TYPE',
+                               'application/x-www-form-urlencoded')
+            environ['REQUEST_METHOD'] = 'POST'
+            req = webapp2.Request.blank(path, environ=environ)
+            req.body_file_raw = six.BytesIO(body)
+            return req.get_response(app)
+
+        rsp = post('/', b'a=1&b=2')
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.body, b'a,b')
+        self.assertEqual(post('/', b'a=1&b=2&c=3').status_int, 413)
+        # The route limit replaces the app limit.
+        self.assertEqual(post('/big', b'a=1234&b=5678').status_int, 200)
+        self.assertEqual(post('/big', b'a=1&b=2&c=3').status_int, 413)
+        # Without a Content-Length, the limit is checked while reading.
+        rsp = post('/', b'a=1234&b=5678', CONTENT_LENGTH='',
+                   **{'wsgi.input_terminated': True})
+        self.assertEqual(rsp.status_int, 413)
+
+        app.limits = {'max_form_bytes': 10}
+        body = b'--x\r\nContent-Disposition: form-data; name="a"\r\n\r\n'
+        for value, status in ((b'123456789', 200), (b'1234567890', 413)):
+            rsp = post('/parts', body + value + b'\r\n--x--\r\n',
+                       CONTENT_TYPE='multipart/form-data; boundary=x')
+            self.assertEqual(rsp.status_int, status)
+
+    def test_truncated_parts(self):
+        class Handler(webapp2.RequestHandler):
+            def post(self):
+                for part in self.request.iter_parts():
+                    self.response.write(part.read())
+
+            def put(self):
+                for name, part in self.request.form_parts.items():
+                    self.response.write(part.value)
+
+        app = webapp2.WSGIApplication([webapp2.Route('/', Handler)])
+        body = (b'--x\r\nContent-Disposition: form-data; name="a"\r\n\r\n'
+                b'12345')
+        for method in ('POST', 'PUT'):
+            req = webapp2.Request.blank('/', environ={
+                'REQUEST_METHOD': method,
+                'CONTENT_TYPE': 'multipart/form-data; boundary=x',
+                'CONTENT_LENGTH': str(len(body)),
+            })
+            req.body_file_raw = six.BytesIO(body)
+            rsp = req.get_response(app)
+            self.assertEqual(rsp.status_int, 400)
+
+    def test_decode_content(self):
+        class Request(webapp2.Request):
+            decode_content = True
+            body_chunk_size = 16
+
+        class Handler(webapp2.RequestHandler):
+            def post(self):
+                if self.request.content_type == 'application/json':
+                    self.response.write(','.join(self.request.json))
+                elif self.request.content_type == 'multipart/form-data':
+                    for part in self.request.iter_parts():
+                        self.response.write(part.read())
+                else:
+                    self.response.write(self.request.get('a'))
+
+        app = webapp2.WSGIApplication([webapp2.Route('/', Handler)])
+        app.request_class = Request
+        app.limits = {'max_decoded_size': 1000}
+
+        def compress(data, wbits):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+            return compressor.compress(data) + compressor.flush()
+
+        def post(body, encoding, content_type='application/json'):
+            req = Request.blank('/', environ={
+                'REQUEST_METHOD': 'POST',
+                'CONTENT_TYPE': content_type,
+                'CONTENT_LENGTH': str(len(body)),
+                'HTTP_CONTENT_ENCODING': encoding,
+            })
+            req.body_file_raw = six.BytesIO(body)
+            return req.get_response(app)
+
+        data = b'["' + b'x' * 100 + b'", "y"]'
+        for encoding, wbits in (('gzip', 16 + zlib.MAX_WBITS),
+                                ('deflate', zlib.MAX_WBITS),
+                                ('deflate', -zlib.MAX_WBITS)):
+            rsp = post(compress(data, wbits), encoding)
+            self.assertEqual(rsp.status_int, 200)
+            self.assertEqual(rsp.body, b'x' * 100 + b',y')
+
+        gzip = 16 + zlib.MAX_WBITS
+        rsp = post(compress(b'a=1&b=2', gzip), 'gzip',
+                   'application/x-www-form-urlencoded')
+        self.assertEqual(rsp.body, b'1')
+        body = (b'--x\r\nContent-Disposition: form-data; name="a"\r\n\r\n'
+                b'value\r\n--x--\r\n')
+        rsp = post(compress(body, gzip), 'gzip',
+                   'multipart/form-data; boundary=x')
+        self.assertEqual(rsp.body, b'value')
+
+        # A small body that decompresses past the limit.
+        rsp = post(compress(b'[' + b' ' * 100000 + b']', gzip), 'gzip')
+        self.assertEqual(rsp.status_int, 413)
+        rsp = post(compress(data, gzip)[:-10], 'gzip')
+        self.assertEqual(rsp.status_int, 400)
+        rsp = post(b'not compressed', 'gzip')
+        self.assertEqual(rsp.status_int, 400)
+
+        # Without max_decoded_size, max_body_size applies.
+        app.limits = {'max_body_size': 1000}
+        rsp = post(compress(data, gzip), 'gzip')
+        self.assertEqual(rsp.status_int, 200)
+        rsp = post(compress(b'[' + b' ' * 100000 + b']', gzip), 'gzip')
+        self.assertEqual(rsp.status_int, 413)
+
     def test_500(self):
         req = webapp2.Request.blank('/broken')
         rsp = req.get_response(app)
@@ -242,6 +484,47 @@ class TestHandler(BaseTestCase):
         self.assertEqual(rsp.status_int, 200)
         self.assertEqual(rsp.body, b'I am a laaazy view.')
 
+    def test_warmup(self):
+        route = webapp2.Route('/lazy', 'tests.resources.handlers.LazyHandler')
+        lazy_app = webapp2.WSGIApplication([route])
+        report = lazy_app.warmup(fail_fast=True)
+        self.assertEqual(report['handlers'], 1)
+        self.assertEqual(report['errors'], [])
+        self.assertTrue(route.handler_adapter is not None)
+        self.assertEqual(sorted(lazy_app.router._index.methods),
+                         sorted(lazy_app.allowed_methods))
+
+        rsp = webapp2.Request.blank('/lazy').get_response(lazy_app)
+        self.assertEqual(rsp.body, b'I am a laaazy view.')
+
+    def test_lazy_handler_threads(self):
+        route = webapp2.Route('/lazy', 'tests.resources.handlers.LazyHandler')
+        lazy_app = webapp2.WSGIApplication([route])
+
+        def slow_import(name, silent=False):
+            time.sleep(0.01)
+            return import_string(name, silent)
+
+        import_string = webapp2.import_string
+        bodies = []
+
+        def get():
+            rsp = webapp2.Request.blank('/lazy').get_response(lazy_app)
+            bodies.append(rsp.body)
+
+        with mock.patch('webapp2.import_string',
+                        side_effect=slow_import) as patched:
+            threads = [threading.Thread(target=get) for i in range(10)]
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(patched.call_count, 1)
+
+        self.assertEqual(bodies, [b'I am a laaazy view.'] * 10)
+
     def test_handler_with_error(self):
         req = webapp2.Request.blank('/error')
         rsp = req.get_response(app)
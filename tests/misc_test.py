@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+import time
 import unittest
 
 import six
@@ -139,6 +141,45 @@ class TestMiscellaneous(BaseTestCase):
         self.assertEqual(foo.bar, 1)
         self.assertEqual(foo.bar, 1)
 
+    def test_cached_property_threads(self):
+        count = [0]
+
+        class Foo(object):
+            @webapp2.cached_property
+            def bar(self):
+                count[0] += 1
+                time.sleep(0.01)
+                return count[0]
+
+        foo = Foo()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(foo.bar))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(count[0], 1)
+        self.assertEqual(results, [1] * 10)
+
+    def test_cached_property_warm(self):
+        class Foo(object):
+            @webapp2.cached_property
+            def bar(self):
+                return 42
+
+        foo = Foo()
+        self.assertEqual(foo.bar, 42)
+        # Once set, the value is returned without taking the lock, even
+        # when the descriptor is invoked by hand.
+        lock, Foo.__dict__['bar'].lock = Foo.__dict__['bar'].lock, None
+        try:
+            self.assertEqual(Foo.__dict__['bar'].__get__(foo, Foo), 42)
+        finally:
+            Foo.__dict__['bar'].lock = lock
+
     def test_redirect(self):
         app = webapp2.WSGIApplication()
         req = webapp2.Request.blank('/')
@@ -13,12 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import tempfile
 import unittest
 
 import six
 from tests.test_base import BaseTestCase
 
 import webapp2
+from webob.multidict import MultiDict
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
 
 
 def _norm_req(s):
@@ -55,6 +62,35 @@ Content-Length: 0
 _test_req = _norm_req(_test_req)
 _test_req2 = _norm_req(_test_req2) + '\r\n'
 
+_multipart_body = b"""preamble\r
+--boundary\r
+Content-Disposition: form-data; name="title"\r
+\r
+caf\xc3\xa9\r
+--boundary\r
+Content-Disposition: form-data; name="file"; filename="a.txt"\r
+Content-Type: text/plain\r
+\r
+line 1\r
+--boundar\r
+line 3\r
+\r
+--boundary\r
+Content-Disposition: form-data; name="title"\r
+\r
+\r
+--boundary--\r
+"""
+
+
+def _multipart_request(body=_multipart_body, boundary='boundary'):
+    return webapp2.Request.blank('/', environ={
+        'REQUEST_METHOD': 'POST',
+        'CONTENT_TYPE': 'multipart/form-data; boundary=%s' % boundary,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': six.BytesIO(body),
+    })
+
 
 class TestRequest(BaseTestCase):
     def test_charset(self):
@@ -302,6 +338,199 @@ class TestRequest(BaseTestCase):
         res = req.get_range('a', min_value=10, max_value=20, default=100)
         self.assertEqual(res, 10)
 
+    def test_match_path(self):
+        req = webapp2.Request.blank('/foo%20bar/%7Ebaz')
+        self.assertEqual(req.match_path, '/foo bar/~baz')
+        self.assertTrue(req.match_path is req.match_path)
+
+        req.path_info = '/other path'
+        self.assertEqual(req.match_path, '/other path')
+
+        req.script_name = '/app'
+        self.assertEqual(req.match_path, '/app/other path')
+
+    def test_form_limits(self):
+        def request(body, max_fields=None, max_bytes=None, **environ):
+            environ.setdefault('CONTENT_LENGTH', str(len(body)))
+            environ.setdefault('CONTENT_TYPE',
+                               'application/x-www-form-urlencoded')
+            environ['REQUEST_METHOD'] = 'POST'
+            environ['wsgi.input'] = six.BytesIO(body)
+            req = webapp2.Request.blank('/', environ=environ)
+            req.max_form_fields = max_fields
+            req.max_form_bytes = max_bytes
+            return req
+
+        # URL-encoded forms are counted as sent.
+        req = request(b'a=1&&b=%C3%A9&', max_fields=2, max_bytes=14)
+        self.assertEqual(req.POST['b'], u'\xe9')
+        req = request(b'a=1&b=%C3%A9', max_bytes=11)
+        self.assertRaises(webapp2.exc.HTTPRequestEntityTooLarge,
+                          getattr, req, 'POST')
+        req = request(b'a=1&b=%C3%A9', max_bytes=11, CONTENT_LENGTH='',
+                      **{'wsgi.input_terminated': True})
+        self.assertRaises(webapp2.exc.HTTPRequestEntityTooLarge,
+                          getattr, req, 'POST')
+        req = request(b'a=1&b=2&c=3', max_fields=2)
+        self.assertRaises(webapp2.exc.HTTPRequestEntityTooLarge,
+                          getattr, req, 'POST')
+
+        # Multipart fields are counted in bytes, without the files.
+        req = _multipart_request()
+        req.max_form_fields = 3
+        req.max_form_bytes = 15
+        self.assertEqual(req.POST.getall('title'), [u'caf\xe9', u''])
+        for name, value in (('max_form_fields', 2), ('max_form_bytes', 14)):
+            req = _multipart_request()
+            setattr(req, name, value)
+            # The form is rejected before it is parsed.
+            with mock.patch('webob.request.cgi_FieldStorage') as parse:
+                self.assertRaises(webapp2.exc.HTTPRequestEntityTooLarge,
+                                  getattr, req, 'POST')
+            self.assertFalse(parse.called)
+
+    def test_json(self):
+        def request(body, **environ):
+            environ.setdefault('CONTENT_LENGTH', str(len(body)))
+            environ['REQUEST_METHOD'] = 'POST'
+            environ['wsgi.input'] = six.BytesIO(body)
+            return webapp2.Request.blank('/', environ=environ)
+
+        req = request(b'{"name": "caf\xc3\xa9", "ids": [1, 2]}')
+        req.body_chunk_size = 5
+        value = req.json
+        self.assertEqual(value, {'name': u'caf\xe9', 'ids': [1, 2]})
+        self.assertTrue(req.json is value)
+        # The body can still be read.
+        self.assertEqual(req.body, b'{"name": "caf\xc3\xa9", "ids": [1, 2]}')
+
+        req.json = [3]
+        self.assertEqual(req.body, b'[3]')
+        self.assertEqual(req.json, [3])
+        # A new body is decoded again.
+        req.body = b'[4]'
+        self.assertEqual(req.json, [4])
+        req.body_file = six.BytesIO(b'[5]')
+        req.content_length = 3
+        self.assertEqual(req.json, [5])
+
+        req = request(b'{"name": ')
+        self.assertRaises(webapp2.exc.HTTPBadRequest, getattr, req, 'json')
+
+        req = request(b'[1, 2, 3]')
+        req.max_json_size = 8
+        self.assertRaises(webapp2.exc.HTTPRequestEntityTooLarge, getattr,
+                          req, 'json')
+        # Without a Content-Length, the size is checked while reading.
+        req = request(b'[1, 2, 3]', CONTENT_LENGTH='',
+                      **{'wsgi.input_terminated': True})
+        req.max_json_size = 8
+        req.body_chunk_size = 2
+        self.assertRaises(webapp2.exc.HTTPRequestEntityTooLarge, getattr,
+                          req, 'json')
+
+    def test_params_index(self):
+        req = webapp2.Request.blank('/?a=1&b=2&a=3', POST='a=4&c=5')
+        index = req._params_index
+        self.assertEqual(list(index.items()), [
+            ('a', ['1', '3', '4']),
+            ('b', ['2']),
+            ('c', ['5']),
+        ])
+        self.assertTrue(req._params_index is index)
+
+        # Returned lists can be changed without affecting the index.
+        values = req.get_all('a')
+        values.append('6')
+        self.assertEqual(req.get_all('a'), ['1', '3', '4'])
+
+        # The index is rebuilt when the query string changes.
+        req.GET['d'] = '7'
+        self.assertEqual(req.get('d'), '7')
+        req.query_string = 'e=8'
+        self.assertEqual(req.arguments(), ['e', 'a', 'c'])
+
+        # And when the POST variables change.
+        req.POST['b'] = '3'
+        self.assertEqual(req.get('b'), '3')
+        req.POST['b'] = '4'
+        self.assertEqual(req.get_all('b'), ['4'])
+        del req.POST['a']
+        self.assertEqual(req.arguments(), ['e', 'c', 'b'])
+        index = req._params_index
+        with mock.patch.object(MultiDict, 'items') as items:
+            # Unchanged variables are not compared again.
+            self.assertTrue(req._params_index is index)
+            self.assertEqual(items.call_count, 0)
+
+        # Every change to POST is seen.
+        req.POST.add('f', '9')
+        self.assertEqual(req.get('f'), '9')
+        req.POST.extend([('g', '10')])
+        self.assertEqual(req.get('g'), '10')
+        req.POST.setdefault('h', '11')
+        self.assertEqual(req.get('h'), '11')
+        req.POST.update({'h': '12'})
+        self.assertEqual(req.get('h'), '12')
+        req.POST.pop('h')
+        self.assertEqual(req.get('h'), '')
+        req.POST.popitem()
+        self.assertEqual(req.get('g'), '')
+        req.POST.clear()
+        self.assertEqual(req.arguments(), ['e'])
+        self.assertTrue(isinstance(req.POST, MultiDict))
+
+    def test_iter_parts(self):
+        for chunk_size in (1, 7, 64 * 1024):
+            req = _multipart_request()
+            req.body_chunk_size = chunk_size
+            parts = []
+            for part in req.iter_parts():
+                parts.append((part.name, part.filename, part.content_type,
+                              part.read()))
+
+            self.assertEqual(parts, [
+                ('title', None, None, b'caf\xc3\xa9'),
+                ('file', 'a.txt', 'text/plain',
+                 b'line 1\r\n--boundar\r\nline 3\r\n'),
+                ('title', None, None, b''),
+            ])
+
+        # Unread data is skipped.
+        req = _multipart_request()
+        req.body_chunk_size = 4
+        names = [part.name for part in req.iter_parts()]
+        self.assertEqual(names, ['title', 'file', 'title'])
+
+    def test_iter_parts_invalid(self):
+        req = webapp2.Request.blank('/', POST='a=b')
+        self.assertRaises(webapp2.exc.HTTPBadRequest, list, req.iter_parts())
+
+        body = _multipart_body[:-20]
+        req = _multipart_request(body)
+        self.assertRaises(webapp2.exc.HTTPBadRequest, list, req.iter_parts())
+
+    def test_form_parts(self):
+        req = _multipart_request()
+        self.assertEqual(req.form_part_spool_limit, 1024 * 1024)
+        req.form_part_spool_limit = 10
+        parts = req.form_parts
+        self.assertTrue(req.form_parts is parts)
+        self.assertEqual(list(parts.keys()), ['title', 'file', 'title'])
+        self.assertEqual([part.value for part in parts.getall('title')],
+                         [u'caf\xe9', u''])
+
+        upload = parts['file']
+        self.assertEqual(upload.value, b'line 1\r\n--boundar\r\nline 3\r\n')
+        # Files larger than the limit are written to disk.
+        self.assertTrue(upload.file._rolled)
+        self.assertFalse(isinstance(parts['title'].file,
+                                    tempfile.SpooledTemporaryFile))
+
+        # By default small files are kept in memory.
+        req = _multipart_request()
+        self.assertFalse(req.form_parts['file'].file._rolled)
+
     def test_issue_3426(self):
         """When the content-type is 'application/x-www-form-urlencoded' and
         POST data is empty the content-type is dropped by Google appengine.
@@ -13,13 +13,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import random
+import re
+import threading
 import unittest
+import uuid
 
 from tests.test_base import BaseTestCase
 import webapp2
 from webapp2 import BaseRoute, Request, Route, Router
 
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+class CIRoute(Route):
+    """A route that matches paths regardless of their case."""
+
+    @webapp2.cached_property
+    def regex(self):
+        return re.compile(Route.regex.func(self).pattern, re.I)
+
 
 class TestRoute(BaseTestCase):
     def test_no_variable(self):
@@ -222,6 +239,60 @@ class TestRoute(BaseTestCase):
             Request.blank('/'), 'i-dont-exist', (), dict(year='2010')
         )
 
+    def test_build_trusted(self):
+        route = Route(r'/<year:\d{4}>/<:\d{2}>', None)
+        self.assertRaises(ValueError, route.build, Request.blank('/'),
+                          ('aa',), dict(year='201a'))
+        url = route.build(Request.blank('/'), ('aa',),
+                          dict(year='201a', _trusted=True))
+        self.assertEqual(url, '/201a/aa')
+
+        # Other routes don't get the keyword.
+        class KwargsRoute(BaseRoute):
+            def build(self, request, args, kwargs):
+                return '/?' + ','.join(sorted(kwargs))
+
+        router = Router([KwargsRoute(None, name='kwargs')])
+        self.assertEqual(router.build(Request.blank('/'), 'kwargs', (),
+                                      dict(a=1, _trusted=True)),
+                         '/?a')
+
+    def test_build_cache(self):
+        router = Router([
+            Route(r'/<year:\d{4}>', None, name='year'),
+            Route(r'/page/<page>', None, name='page'),
+        ])
+        req = Request.blank('/')
+        self.assertEqual(router.build_cache_info(), None)
+        router.build_cache_size = 10
+
+        for i in range(2):
+            url = router.build(req, 'year', (), dict(year=2010, foo='bar'))
+            self.assertEqual(url, '/2010?foo=bar')
+
+        # Equal values of different types don't share a cache entry.
+        self.assertEqual(router.build(req, 'page', (), dict(page=1)),
+                         '/page/1')
+        self.assertEqual(router.build(req, 'page', (), dict(page=True)),
+                         '/page/True')
+        # URIs that depend on the request or unhashable values aren't
+        # cached.
+        self.assertEqual(router.build(req, 'page', (),
+                                      dict(page=1, _full=True)),
+                         'http://localhost:80/page/1')
+        self.assertEqual(router.build(req, 'page', (),
+                                      dict(page=1, foo=['a'])),
+                         '/page/1?foo=%5B%27a%27%5D')
+        self.assertEqual(router.build_cache_info(), {
+            'hits': 1, 'misses': 3, 'evictions': 0, 'size': 3,
+            'maxsize': 10,
+        })
+        # Errors aren't cached.
+        self.assertRaises(ValueError, router.build, req, 'year', (),
+                          dict(year='201a'))
+        self.assertRaises(ValueError, router.build, req, 'year', (),
+                          dict(year='201a'))
+
     def test_reverse_template(self):
         route = Route('/foo', None)
         route.regex
@@ -282,6 +353,25 @@ class TestRoute(BaseTestCase):
         url = route.build(Request.blank('/'), args, {})
         self.assertEqual(url_res, url)
 
+    def test_match_extractor(self):
+        cases = [
+            ('/foo', '/foo'),
+            ('/<foo>', '/bar'),
+            ('/<:\\d+>', '/42'),
+            ('/<:(a|b)>/<:\\d+>', '/a/42'),
+            ('/<:(a|b)>-<:(c|d)>', '/a-d'),
+            ('/<year:\\d+>/<:\\d+>/<slug>', '/2010/10/foo'),
+            ('/<key:(x)?y>/<:(a)?b>', '/y/b'),
+        ]
+        for template, path in cases:
+            for defaults in (None, {'foo': 'default', 'extra': 1}):
+                route = Route(template, None, defaults=defaults)
+                match = route.regex.match(path)
+                expected = webapp2._get_route_variables(
+                    match, route.defaults.copy())
+                self.assertEqual(route.match(Request.blank(path))[1:],
+                                 expected)
+
     def test_build_only_without_name(self):
         self.assertRaises(ValueError, Route, r'/<foo>', None, build_only=True)
 
@@ -347,6 +437,204 @@ class TestRoute(BaseTestCase):
         router.set_matcher(custom_matcher)
         router.match(req)
 
+    def test_static_routes(self):
+        router = Router([
+            Route(r'/', None, name='home'),
+            Route(r'/<:\d+>', None, name='number'),
+            Route(r'/about', None, name='about'),
+            Route(r'/secure', None, name='secure', schemes=['https']),
+            Route(r'/123', None, name='shadowed'),
+            Route(r'/contact', None, name='contact-get', methods=['GET']),
+            Route(r'/<page>', None, name='page'),
+            Route(r'/contact', None, name='contact-post', methods=['POST']),
+        ])
+
+        self.assertEqual(router.match(Request.blank('/'))[0].name, 'home')
+        self.assertEqual(
+            router.match(Request.blank('/about'))[0].name, 'about')
+        # Earlier routes with variables are tried first.
+        self.assertEqual(
+            router.match(Request.blank('/123'))[0].name, 'number')
+
+        req = Request.blank('/contact')
+        self.assertEqual(router.match(req)[0].name, 'contact-get')
+        req.method = 'POST'
+        # Later routes with variables are tried when methods don't match.
+        self.assertEqual(router.match(req)[0].name, 'page')
+
+        self.assertEqual(
+            router.match(Request.blank('https://localhost/secure'))[0].name,
+            'secure')
+        self.assertEqual(
+            router.match(Request.blank('http://localhost/secure'))[0].name,
+            'page')
+
+        # A route added later is found for a path that was already matched.
+        router = Router([Route(r'/about', None, name='about',
+                               methods=['GET'])])
+        req = Request.blank('/about')
+        req.method = 'POST'
+        self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+        router.add(Route(r'/<page>', None, name='page'))
+        self.assertEqual(router.match(req)[0].name, 'page')
+
+    def test_static_routes_trailing_newline(self):
+        router = Router([Route(r'/about', None, name='about')])
+        self.assertEqual(
+            router.match(Request.blank('/about%0A'))[0].name, 'about')
+
+    def test_trie_matcher(self):
+        router = Router([
+            Route(r'/<:\d+>/<name>', None, name='catch-all'),
+            Route(r'/blog/<year:\d{4}>', None, name='year'),
+            Route(r'/blog/archive', None, name='archive'),
+            Route(r'/blog/<slug>', None, name='post'),
+            Route(r'/users/<user>/profile', None, name='profile'),
+            (r'/legacy/(\w+)', None),
+            Route(r'/blog/edit', None, name='edit', methods=['POST']),
+        ])
+        router.set_matcher(Router.trie_matcher)
+
+        route, args, kwargs = router.match(Request.blank('/1/foo'))
+        self.assertEqual(route.name, 'catch-all')
+        self.assertEqual((args, kwargs), (('1',), {'name': 'foo'}))
+
+        route, args, kwargs = router.match(Request.blank('/blog/2010'))
+        self.assertEqual((route.name, kwargs), ('year', {'year': '2010'}))
+
+        # First match wins even if a later route is more specific.
+        route, args, kwargs = router.match(Request.blank('/blog/archive'))
+        self.assertEqual(route.name, 'archive')
+        route, args, kwargs = router.match(Request.blank('/blog/edit'))
+        self.assertEqual(route.name, 'post')
+
+        route, args, kwargs = router.match(
+            Request.blank('/users/%7Erodrigo/profile'))
+        self.assertEqual(
+            (route.name, kwargs), ('profile', {'user': '~rodrigo'}))
+
+        # Routes that can't be indexed are still tried.
+        route, args, kwargs = router.match(Request.blank('/legacy/foo'))
+        self.assertEqual(args, ('foo',))
+
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          Request.blank('/users/rodrigo'))
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          Request.blank('/blog/1/2'))
+
+        # Routes added later are indexed too.
+        router.add(Route(r'/users/<user>', None, name='user'))
+        route, args, kwargs = router.match(Request.blank('/users/rodrigo'))
+        self.assertEqual(route.name, 'user')
+
+    def test_trie_matcher_methods(self):
+        router = Router([
+            Route(r'/items/<id>', None, name='get', methods=['GET']),
+            Route(r'/items/<id>', None, name='post', methods=['POST']),
+        ])
+        router.set_matcher(Router.trie_matcher)
+
+        req = Request.blank('/items/1')
+        req.method = 'POST'
+        self.assertEqual(router.match(req)[0].name, 'post')
+        req.method = 'PUT'
+        self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+
+    def test_combined_matcher(self):
+        routes = [
+            Route(r'/', None, name='home'),
+            Route(r'/blog/<year:\d{4}>/<month:\d{2}>', None, name='month',
+                  defaults={'page': '1'}),
+            Route(r'/blog/<:(draft|post)>/<slug>', None, name='post'),
+            webapp2.SimpleRoute(r'/legacy/(\w+)', None),
+            Route(r'/blog/<slug>', None, name='slug'),
+            Route(r'/secure/<path:.*>', None, name='secure',
+                  schemes=['https']),
+            Route(r'/<path:.*>', None, name='catch-all', methods=['GET']),
+        ]
+        router = Router(routes)
+        combined = Router(routes)
+        combined.set_matcher(Router.combined_matcher)
+
+        for path in ('/', '/blog/2010/09', '/blog/draft/foo', '/legacy/foo',
+                     '/blog/foo', '/secure/foo', '/a/b/c',
+                     'https://localhost/secure/foo'):
+            req = Request.blank(path)
+            self.assertEqual(combined.match(req), router.match(req))
+
+        req = Request.blank('/blog/2010/09')
+        self.assertEqual(
+            combined.match(req),
+            (routes[1], (), {'year': '2010', 'month': '09', 'page': '1'}))
+        req = Request.blank('/blog/draft/foo')
+        self.assertEqual(
+            combined.match(req), (routes[2], ('draft',), {'slug': 'foo'}))
+
+        req = Request.blank('/a/b/c')
+        req.method = 'POST'
+        self.assertRaises(
+            webapp2.exc.HTTPMethodNotAllowed, combined.match, req)
+
+        combined.add(Route(r'/<path:.*>', None, name='post-all',
+                           methods=['POST']))
+        self.assertEqual(combined.match(req)[0].name, 'post-all')
+
+    def test_combined_matcher_many_variables(self):
+        template = r'/<:\d+>' * 98
+        args = tuple(str(i) for i in range(98))
+        router = Router([Route(template, None), Route('/<a>', None)])
+        router.set_matcher(Router.combined_matcher)
+        self.assertEqual(router.match(Request.blank('/' + '/'.join(args))),
+                         (router.match_routes[0], args, {}))
+        self.assertEqual(router.match(Request.blank('/foo'))[2], {'a': 'foo'})
+
+    def test_combined_matcher_reorder(self):
+        routes = [Route('/r%d/<id>' % i, None) for i in range(100)]
+        combined = webapp2._CombinedRoutes(routes)
+        combined.prepare(['GET'])
+        routes[-2:] = routes[:-3:-1]
+        reordered = combined.reorder(routes)
+        self.assertEqual(list(reordered.buckets), ['GET'])
+
+        def regexes(combined):
+            return set(regex for regex, entries, routes
+                       in combined.buckets['GET'][0])
+
+        # Only the runs with the swapped routes are compiled again.
+        self.assertTrue(len(regexes(reordered) - regexes(combined)) <= 2)
+        self.assertEqual(len(regexes(reordered) - regexes(combined)),
+                         len(regexes(combined) - regexes(reordered)))
+        self.assertEqual(reordered.match(Request.blank('/r99/1'))[0],
+                         routes[98])
+
+    def test_match_cache(self):
+        def handler(request, *args, **kwargs):
+            # Handlers can't change the cached keywords.
+            request.route_kwargs['page'] = 'changed'
+            return webapp2.Response(kwargs.get('page', 'home'))
+
+        app = webapp2.WSGIApplication([
+            Route('/', handler),
+            Route('/<page>', handler),
+        ])
+        self.assertEqual(app.router.match_cache_info(), None)
+        app.router.match_cache_size = 2
+
+        self.assertEqual(app.get_response('/foo').body, b'foo')
+        self.assertEqual(app.get_response('/foo').body, b'foo')
+        self.assertEqual(app.get_response('/bar').body, b'bar')
+        self.assertEqual(app.get_response('/').body, b'home')
+        self.assertEqual(app.get_response('/foo').body, b'foo')
+        self.assertEqual(app.get_response('/foo', POST={}).status_int, 200)
+        self.assertEqual(app.router.match_cache_info(), {
+            'hits': 1, 'misses': 5, 'evictions': 3, 'size': 2,
+            'maxsize': 2,
+        })
+
+        # Adding a route clears the cache.
+        app.router.add(Route('/foo/bar', handler))
+        self.assertEqual(app.router.match_cache_info()['size'], 0)
+
     def test_set_builder(self):
         def custom_builder(router, request, name, args, kwargs):
             self.assertEqual(request, req)
@@ -388,6 +676,430 @@ class TestRoute(BaseTestCase):
         req.method = 'PUT'
         self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
 
+    def test_methods_index(self):
+        get_route = Route(r'/items/<id>', None, methods=['GET'])
+        post_route = Route(r'/items/<id>', None, methods=['POST'])
+        static_route = Route(r'/items', None, methods=['GET'])
+        router = Router([get_route, post_route, static_route])
+
+        req = Request.blank('/items/1')
+        req.method = 'POST'
+        with mock.patch.object(Route, 'match', autospec=True,
+                               side_effect=Route.match) as match:
+            self.assertEqual(router.match(req)[0], post_route)
+            # Routes that don't allow the method are not tried.
+            match.assert_called_once_with(post_route, req)
+
+            req.method = 'PUT'
+            self.assertRaises(
+                webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+            req = Request.blank('/items')
+            req.method = 'POST'
+            self.assertRaises(
+                webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+            self.assertEqual(match.call_count, 1)
+
+        req = Request.blank('/other')
+        req.method = 'PUT'
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match, req)
+
+    def test_unquote_path_once(self):
+        router = Router([Route('/foo/<:\\d+>', None)] * 10 + [
+            webapp2.SimpleRoute('/foo/(.*)', None),
+            Route('/foo/<name>', None),
+        ])
+        req = Request.blank('/foo/b%61r')
+        with mock.patch('webapp2.unquote', wraps=webapp2.unquote) as unquote:
+            self.assertEqual(router.match(req)[1], ('bar',))
+            self.assertEqual(router.match_routes[0].match(req), None)
+            self.assertEqual(unquote.call_count, 1)
+
+    def test_compile(self):
+        from webapp2_extras import routes
+
+        lazy = Route('/lazy', 'tests.resources.handlers.LazyHandler', 'lazy')
+        nested = Route('/<name>', 'tests.resources.handlers.LazyHandler',
+                       'nested')
+        missing = Route('/missing', 'tests.resources.handlers.Missing')
+        router = Router([
+            lazy,
+            routes.PathPrefixRoute('/prefix', [nested]),
+            missing,
+            Route('/none', None),
+        ])
+
+        report = router.compile(methods=['GET'])
+        self.assertEqual(report['routes'], 5)
+        self.assertEqual(report['handlers'], 2)
+        self.assertEqual(report['builders'], 2)
+        self.assertEqual(len(report['errors']), 1)
+        self.assertTrue(report['errors'][0][0] is missing)
+        self.assertTrue(isinstance(report['errors'][0][1],
+                                   webapp2.ImportStringError))
+        self.assertEqual(sorted(report['timings']), [
+            'builders', 'handlers', 'indexes', 'regex', 'total'])
+        self.assertTrue(lazy.handler_adapter is not None)
+        self.assertTrue(nested.handler_adapter is not None)
+        self.assertTrue(missing.handler_adapter is None)
+        self.assertTrue('regex' in nested.__dict__)
+        self.assertTrue('_builder' in lazy.__dict__)
+        self.assertTrue('GET' in router._index.methods)
+
+        # Adapters already loaded are skipped.
+        self.assertEqual(router.compile()['handlers'], 0)
+        self.assertRaises(webapp2.ImportStringError, router.compile,
+                          fail_fast=True)
+
+    def test_compile_matchers(self):
+        router = Router([Route('/<name>', None)])
+        router.set_matcher(Router.trie_matcher)
+        router.compile()
+        self.assertTrue(router._trie is not None)
+
+        router.set_matcher(Router.combined_matcher)
+        router.compile(methods=['GET', 'POST'])
+        self.assertEqual(sorted(router._combined.buckets), ['GET', 'POST'])
+
+    def test_reorder_routes(self):
+        home = Route('/', None)
+        user = Route('/users/<id>', None)
+        edit = Route('/users/<id>/edit', None, methods=['GET'])
+        post = Route('/users/<id>/edit', None, methods=['POST'])
+        any_user = Route('/users/<path:.*>', None)
+        item = Route('/items/<id>', None)
+        router = Router([home, user, edit, post, any_user, item])
+        router.reorder_interval = 3
+
+        def match(path, method='GET'):
+            req = Request.blank(path)
+            req.method = method
+            return router.match(req)[0]
+
+        self.assertEqual(match('/items/1'), item)
+        self.assertEqual(match('/users/1/edit', 'POST'), post)
+        self.assertEqual(router.match_order_info(), [
+            (home, 0), (user, 0), (edit, 0), (post, 1), (any_user, 0),
+            (item, 1)])
+        self.assertEqual(match('/items/2'), item)
+        # A single pass is made after the interval.
+        self.assertEqual(router.match_routes,
+                         (item, home, user, edit, post, any_user))
+        # Hot routes only move ahead of routes they can't overlap with.
+        self.assertTrue(router.reorder_routes())
+        self.assertEqual(router.match_routes,
+                         (item, home, user, post, edit, any_user))
+        self.assertEqual(router.match_order_info(), [
+            (item, 2), (home, 0), (user, 0), (post, 1), (edit, 0),
+            (any_user, 0)])
+
+        self.assertEqual(match('/'), home)
+        self.assertEqual(match('/users/1'), user)
+        self.assertEqual(match('/users/1/edit'), edit)
+        self.assertEqual(match('/users/1/edit', 'POST'), post)
+        self.assertEqual(match('/users/1/edit', 'PUT'), any_user)
+        self.assertFalse(router.reorder_routes())
+
+    def test_reorder_routes_matchers(self):
+        home = Route('/', None)
+        user = Route('/users/<id>', None)
+        item = Route('/items/<id>', None)
+        for matcher in (Router.default_matcher, Router.trie_matcher,
+                        Router.combined_matcher):
+            router = Router([home, user, item])
+            router.set_matcher(matcher)
+            router.reorder_interval = 2
+            # Offline matches are not counted.
+            self.assertEqual(len(list(router.match_many(['/items/1'] * 3))),
+                             3)
+            self.assertEqual(router.match_order_info(),
+                             [(home, 0), (user, 0), (item, 0)])
+            self.assertEqual(router.match(Request.blank('/items/1'))[0],
+                             item)
+            indexes = (router._index, router._trie, router._combined)
+            self.assertEqual(router.match(Request.blank('/items/2'))[0],
+                             item)
+            self.assertEqual(router.match_routes, (item, home, user))
+            # Only the index of the matcher is rebuilt.
+            rebuilt = [old is not new for old, new in zip(
+                indexes, (router._index, router._trie, router._combined))]
+            self.assertEqual(rebuilt.count(True), 1)
+            self.assertEqual(router.match(Request.blank('/users/1'))[0],
+                             user)
+
+    def test_are_disjoint(self):
+        def disjoint(template, other, **kwargs):
+            return webapp2._are_disjoint(Route(template, None, **kwargs),
+                                         Route(other, None))
+
+        self.assertTrue(disjoint('/foo/<id>', '/bar/<id>'))
+        self.assertTrue(disjoint('/<id>/edit', '/<id>/view'))
+        self.assertTrue(disjoint('/foo', '/foo/<id>'))
+        self.assertTrue(disjoint('/foo', '/foo/bar'))
+        self.assertFalse(disjoint('/foo', '/foo<id:.*>'))
+        self.assertFalse(disjoint('/foo/<id>', '/foo/<name>'))
+        self.assertFalse(disjoint('/<id>', '/<id>/edit'))
+        self.assertFalse(webapp2._are_disjoint(
+            Route('/foo', None), webapp2.SimpleRoute('/bar', None)))
+
+    def test_match_many(self):
+        from webapp2_extras import routes
+
+        router = Router([
+            Route('/', None, 'home'),
+            Route(r'/users/<id:\d+>', None, 'user', methods=['GET']),
+            routes.DomainRoute('<sub>.example.com', [
+                Route('/sub', None, 'sub'),
+            ]),
+            Route('/secure', None, 'secure', schemes=['https']),
+        ])
+        paths = ['/', '/users/1?foo=bar', '/users/a', '/users/1', '/sub',
+                 '/secure', '/users/%31']
+        self.assertEqual(list(router.match_many(paths)), [
+            ('home', (), {}),
+            ('user', (), {'id': '1'}),
+            None,
+            ('user', (), {'id': '1'}),
+            None,
+            None,
+            ('user', (), {'id': '1'}),
+        ])
+        self.assertEqual(
+            list(router.match_many(['/users/1', '/sub', '/secure'],
+                                   method='POST', host='a.example.com:8080',
+                                   scheme='https')),
+            [None, ('sub', (), {'sub': 'a'}), ('secure', (), {})])
+
+        with mock.patch.object(Route, 'match', autospec=True,
+                               side_effect=Route.match) as match:
+            results = list(router.match_many(['/users/1'] * 3))
+            # Repeated paths are matched once.
+            self.assertEqual(match.call_count, 1)
+
+        self.assertEqual(results, [('user', (), {'id': '1'})] * 3)
+        results[0][2]['id'] = '2'
+        self.assertEqual(results[1][2], {'id': '1'})
+
+    def test_add_copy_on_write(self):
+        foo = Route('/foo', None, 'foo')
+        router = Router([foo])
+        router.match_cache_size = 10
+        match_routes = router.match_routes
+        build_routes = router.build_routes
+        index = router._index
+        req = Request.blank('/foo')
+        router._cached_match(req)
+
+        bar = Route('/bar', None, 'bar')
+        router.add(bar)
+        # The previous table is left as it was, for requests using it.
+        self.assertEqual(match_routes, (foo,))
+        self.assertEqual(build_routes, {'foo': foo})
+        self.assertEqual(index.lookup('/bar', 'GET')[0], [])
+        self.assertEqual(router.match_routes, (foo, bar))
+        self.assertEqual(router.build_routes, {'foo': foo, 'bar': bar})
+        self.assertEqual(router.match_cache_info()['size'], 0)
+        self.assertEqual(router.match_cache_info()['misses'], 1)
+
+    def test_add_routes(self):
+        foo = Route('/foo', None, 'foo')
+        router = Router([foo])
+        with mock.patch.object(webapp2._RouteTable, 'copy',
+                               autospec=True,
+                               side_effect=webapp2._RouteTable.copy) as copy:
+            router.add_routes([Route('/item/<id>', None, 'item'),
+                               ('/bar', None)])
+        self.assertEqual(copy.call_count, 1)
+        self.assertEqual(len(router.match_routes), 3)
+        self.assertEqual(router.match(Request.blank('/item/1'))[2],
+                         {'id': '1'})
+        self.assertTrue(isinstance(router.match(Request.blank('/bar'))[0],
+                                   webapp2.SimpleRoute))
+
+    def test_add_batch(self):
+        router = Router([Route('/foo', None, 'foo')])
+        with mock.patch.object(webapp2._RouteTable, 'copy',
+                               autospec=True,
+                               side_effect=webapp2._RouteTable.copy) as copy:
+            for i in range(3):
+                router.add(Route('/r%d' % i, None))
+
+            # Routes added before the router is used share one copy.
+            self.assertEqual(copy.call_count, 1)
+            self.assertEqual(router.match(Request.blank('/r2'))[0],
+                             router.match_routes[3])
+            router.add(Route('/bar', None))
+            self.assertEqual(copy.call_count, 2)
+
+        self.assertEqual(len(router.match_routes), 5)
+        # Routes can't be changed in place.
+        with self.assertRaises(AttributeError):
+            router.match_routes.append(Route('/baz', None))
+
+    def test_set_routes(self):
+        foo = Route('/foo', None, 'foo')
+        bar = Route('/bar', None, 'bar')
+        router = Router([foo])
+        router.match_routes = [bar]
+        self.assertEqual(router.match(Request.blank('/bar')), (bar, (), {}))
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          Request.blank('/foo'))
+
+        router.build_routes = {'bar': bar}
+        self.assertEqual(router.build_routes, {'bar': bar})
+        self.assertRaises(KeyError, router.build, Request.blank('/'),
+                          'foo', (), {})
+
+    def test_add_threads(self):
+        router = Router([Route('/', None)])
+        errors = []
+        done = threading.Event()
+
+        def match():
+            req = Request.blank('/item/1')
+            while not done.is_set():
+                try:
+                    router.match(req)
+                except webapp2.exc.HTTPNotFound:
+                    pass
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=match) for i in range(4)]
+        for thread in threads:
+            thread.start()
+
+        for i in range(200):
+            router.add(Route('/item/<id:%d>' % i, None))
+
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(router.match_routes), 201)
+        self.assertEqual(router.match(Request.blank('/item/1'))[0],
+                         router.match_routes[2])
+
+    def test_converters(self):
+        day = datetime.date(2016, 2, 29)
+        key = uuid.UUID('12345678-1234-5678-1234-567812345678')
+        route = Route('/<day:date>/<key:uuid>/<:int>', None, 'post')
+        for matcher in (Router.default_matcher, Router.trie_matcher,
+                        Router.combined_matcher):
+            router = Router([route, Route('/<day>/<key>/<id>', None)])
+            router.set_matcher(matcher)
+            req = Request.blank('/2016-02-29/%s/0042' % key)
+            self.assertEqual(router.match(req), (route, (42,), {
+                'day': day,
+                'key': key,
+            }))
+            # Invalid values don't match the route.
+            req = Request.blank('/2016-02-30/%s/1' % key)
+            self.assertNotEqual(router.match(req)[0], route)
+
+        req = Request.blank('/')
+        self.assertEqual(route.build(req, (42,), {'day': day, 'key': key}),
+                         '/2016-02-29/%s/42' % key)
+        self.assertEqual(route.build(req, ('7',), {
+            'day': '2016-02-29',
+            'key': str(key).upper(),
+        }), '/2016-02-29/%s/7' % key)
+        self.assertRaises(ValueError, route.build, req, (-1,),
+                          {'day': day, 'key': key})
+        self.assertRaises(ValueError, route.build, req, (1,),
+                          {'day': day, 'key': 'foo'})
+        self.assertRaises(ValueError, route.build, req, (1,),
+                          {'day': '2016-13-01', 'key': key, '_trusted': True})
+
+    def test_regex_override(self):
+        about = CIRoute('/About', None)
+        router = Router([about, Route('/other', None)])
+        self.assertEqual(router.match(Request.blank('/about')),
+                         (about, (), {}))
+
+    def test_regex_override_combined(self):
+        user = CIRoute(r'/users/<id:\d+>', None)
+        router = Router([Route('/items/<id>', None), user,
+                         Route('/users/<name>', None)])
+        router.set_matcher(Router.combined_matcher)
+        self.assertEqual(router.match(Request.blank('/USERS/3')),
+                         (user, (), {'id': '3'}))
+
+    def test_regex_override_trie(self):
+        user = CIRoute(r'/users/<id:\d+>', None)
+        router = Router([Route('/users', None), user])
+        router.set_matcher(Router.trie_matcher)
+        self.assertEqual(router.match(Request.blank('/USERS/3')),
+                         (user, (), {'id': '3'}))
+
+    def test_get_match_path(self):
+        class LowerRoute(Route):
+            def get_match_path(self, request):
+                return super(LowerRoute, self).get_match_path(
+                    request).lower()
+
+        for template in ('/about', '/page/<name>'):
+            route = LowerRoute(template, None)
+            for matcher in (Router.default_matcher, Router.trie_matcher,
+                            Router.combined_matcher):
+                router = Router([route])
+                router.set_matcher(matcher)
+                match = router.match(Request.blank(template.replace(
+                    '<name>', 'Home').upper()))
+                self.assertTrue(match[0] is route)
+
+    def test_converters_method_not_allowed(self):
+        route = Route('/day/<day:date>', None, methods=['POST'])
+        for matcher in (Router.default_matcher, Router.trie_matcher,
+                        Router.combined_matcher):
+            router = Router([route])
+            router.set_matcher(matcher)
+            req = Request.blank('/day/2020-01-31')
+            self.assertRaises(webapp2.exc.HTTPMethodNotAllowed,
+                              router.match, req)
+            # A value rejected by the converter is not found.
+            req = Request.blank('/day/2020-13-45')
+            self.assertRaises(webapp2.exc.HTTPNotFound, router.match, req)
+
+    def test_converter_to_url(self):
+        route = Route('/<name:default>/<id:int>', None)
+        route.converters = dict(Route.converters,
+                                default=webapp2.BaseConverter())
+        req = Request.blank('/')
+        self.assertEqual(route.build(req, (), {'name': 'a', 'id': 1}),
+                         '/a/1')
+        # The result of to_url() must match the converter regex.
+        self.assertRaises(ValueError, route.build, req, (),
+                          {'name': 'a/b', 'id': 1})
+        self.assertEqual(route.build(req, (), {'name': 'a/b', 'id': 1,
+                                               '_trusted': True}),
+                         '/a/b/1')
+
+    def test_register_converter(self):
+        class SlugConverter(webapp2.BaseConverter):
+            regex = '[a-z-]+'
+
+            def to_python(self, value):
+                return value.replace('-', ' ')
+
+            def to_url(self, value):
+                return value.replace(' ', '-')
+
+        class SlugRoute(Route):
+            converters = dict(Route.converters, slug=SlugConverter())
+
+        route = SlugRoute('/<title:slug>/<id:int>', None, 'post')
+        router = Router([route])
+        self.assertEqual(router.match(Request.blank('/hello-world/1')),
+                         (route, (), {'title': 'hello world', 'id': 1}))
+        self.assertEqual(route.build(Request.blank('/'), (),
+                                     {'title': 'hello world', 'id': 1}),
+                         '/hello-world/1')
+        # Plain routes don't know the converter.
+        route = Route('/<title:slug>', None)
+        self.assertEqual(route.match(Request.blank('/slug')),
+                         (route, (), {'title': 'slug'}))
+
     def test_schemes(self):
         route = Route(r'/', schemes=['http'])
         req = Request.blank('http://mydomain.com/')
@@ -25,14 +25,20 @@ Taking Google App Engine's webapp to the next level!
 
 import cgi
 from collections import OrderedDict
+import datetime
+import heapq
 import inspect
 import logging
 import os
 import re
 import sys
+import tempfile
 import threading
+import timeit
 import traceback
+import uuid
 from wsgiref import handlers
+import zlib
 
 import six
 from six.moves import cStringIO
@@ -44,6 +50,8 @@ from six.moves.urllib.parse import urlunsplit
 
 import webob
 from webob import exc
+from webob.multidict import MultiDict
+from webob.multidict import NoVars
 
 
 _webapp = _webapp_util = _local = None
@@ -96,6 +104,8 @@ _route_re = re.compile(r"""
     (?:\:([^\>]*))?  # The optional :regex part
     \>               # The exact character ">"
     """, re.VERBOSE)
+#: Regex for backreferences, which can't be moved to another regex.
+_backreference_re = re.compile(r'\\\d|\(\?P=')
 #: Regex extract charset from environ.
 _charset_re = re.compile(r';\s*charset=([^;]*)', re.I)
 
@@ -161,6 +171,29 @@ class Request(webob.Request):
     registry = None
     # Attributes from webapp.
     request_body_tempfile_limit = 0
+    #: Uploaded files larger than this number of bytes are spooled to a
+    #: temporary file by :attr:`form_parts`. If 0, they are kept in memory.
+    form_part_spool_limit = 1024 * 1024
+    #: Number of bytes read from the body at a time by :meth:`iter_parts`.
+    body_chunk_size = 64 * 1024
+    #: Maximum size of the body in bytes, or None for no limit. It is set
+    #: when the request is dispatched. See :attr:`WSGIApplication.limits`.
+    max_body_size = None
+    #: Maximum number of form fields and files, or None for no limit.
+    max_form_fields = None
+    #: Maximum total size in bytes of form field names and values as they
+    #: are sent, not counting uploaded files, or None for no limit. For
+    #: URL-encoded forms, this is the size of the body.
+    max_form_bytes = None
+    #: Maximum size in bytes of a body decoded by :attr:`json`, or None for
+    #: no limit.
+    max_json_size = None
+    #: If True, bodies with ``Content-Encoding: gzip`` or ``deflate`` are
+    #: decompressed while they are read, when the request is dispatched.
+    decode_content = False
+    #: Maximum size in bytes of a decompressed body. If None (the default)
+    #: :attr:`max_body_size` applies. See :attr:`decode_content`.
+    max_decoded_size = None
     #: Charset provided in requests @CONTENT_TYPE.
     _request_charset = None
 
@@ -187,6 +220,52 @@ class Request(webob.Request):
         super(Request, self).__init__(environ, *args, **kwargs)
         self.registry = {}
 
+    @property
+    def match_path(self):
+        """The unquoted request path, used to match routes.
+
+        It is decoded once and reused until the path changes, so routes
+        don't need to call ``unquote(request.path)`` themselves.
+        """
+        environ = self.environ
+        key = (environ.get('SCRIPT_NAME', ''), environ.get('PATH_INFO', ''))
+        cached = environ.get('webapp2.match_path')
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        path = unquote(self.path)
+        environ['webapp2.match_path'] = (key, path)
+        return path
+
+    @property
+    def POST(self):
+        """A ``MultiDict`` with the variables of a form request.
+
+        The form body is checked against :attr:`max_form_fields` and
+        :attr:`max_form_bytes` before it is parsed, so no field is built for
+        a form that exceeds them. With these limits, a malformed
+        ``multipart/form-data`` body gets a 400 error.
+
+        .. seealso:: The WebOb documentation.
+        """
+        environ = self.environ
+        if (self.max_form_fields is not None or
+                self.max_form_bytes is not None) and \
+                environ.get('webapp2.checked_form') is not \
+                environ.get('wsgi.input'):
+            _check_form_body(self)
+            environ['webapp2.checked_form'] = environ.get('wsgi.input')
+
+        post = super(Request, self).POST
+        if type(post) is MultiDict:
+            # Replace the parsed variables by a copy that counts changes.
+            parsed = environ.get('webob._parsed_post_vars')
+            if parsed is not None and parsed[0] is post:
+                post = _PostVars(post)
+                environ['webob._parsed_post_vars'] = (post, parsed[1])
+
+        return post
+
     def get(self, argument_name, default_value='', allow_multiple=False):
         """Returns the query or POST argument with the given name.
 
@@ -244,23 +323,53 @@ class Request(webob.Request):
         if default_value is None:
             default_value = []
 
-        param_value = self.params.getall(argument_name)
+        param_value = self._params_index.get(argument_name)
 
-        if param_value is None or len(param_value) == 0:
+        if not param_value:
             return default_value
 
-        for i in six.moves.range(len(param_value)):
-            if isinstance(param_value[i], cgi.FieldStorage):
-                param_value[i] = param_value[i].value
-
-        return param_value
+        return list(param_value)
 
     def arguments(self):
         """Returns a list of the arguments provided in the query and/or POST.
 
         The return value is an ordered list of strings.
         """
-        return list(OrderedDict.fromkeys(self.params.keys()))
+        return list(self._params_index)
+
+    @property
+    def _params_index(self):
+        """An ordered mapping of query and POST argument names to lists of
+        values, with uploaded files replaced by their contents.
+
+        It is built on first access and reused until the query string or
+        the POST variables change: :attr:`POST` counts its changes, so this
+        check takes constant time.
+        """
+        environ = self.environ
+        post = self.POST
+        if isinstance(post, NoVars):
+            post = None
+            version = 0
+        else:
+            # Changes are only counted in variables parsed by this class.
+            version = getattr(post, 'version', None)
+
+        key = (environ.get('QUERY_STRING', ''), version)
+        cached = environ.get('webapp2.params_index')
+        if cached is not None and cached[0] == key and cached[1] is post \
+                and version is not None:
+            return cached[2]
+
+        index = OrderedDict()
+        for name, value in self.params.items():
+            if isinstance(value, cgi.FieldStorage):
+                value = value.value
+
+            index.setdefault(name, []).append(value)
+
+        environ['webapp2.params_index'] = (key, post, index)
+        return index
 
     def get_range(self, name, min_value=None, max_value=None, default=0):
         """Parses the given int argument, limiting it to the given range.
@@ -293,6 +402,148 @@ class Request(webob.Request):
 
         return value
 
+    def iter_parts(self):
+        """Parses a ``multipart/form-data`` body while it is read.
+
+        The body is read in chunks of :attr:`body_chunk_size` bytes, so
+        large uploads can be processed without loading them in memory::
+
+            for part in self.request.iter_parts():
+                if part.filename:
+                    for chunk in part:
+                        output.write(chunk)
+
+        Each part must be read before the next one is requested: unread
+        data is skipped. Call :meth:`FormPart.spool` to keep it. The body
+        is consumed, so :attr:`POST` is not available afterwards, unless
+        the body was already read.
+
+        :returns:
+            A generator of :class:`FormPart` instances.
+        :raises:
+            ``exc.HTTPBadRequest`` if the body is not a valid multipart
+            body, or ``exc.HTTPRequestEntityTooLarge`` if it exceeds
+            :attr:`max_form_fields` or :attr:`max_form_bytes`.
+        """
+        content_type, params = cgi.parse_header(
+            self.environ.get('CONTENT_TYPE', ''))
+        boundary = params.get('boundary')
+        if content_type != 'multipart/form-data' or not boundary:
+            abort(400, 'Expected a multipart/form-data body.')
+
+        stream = self.body_file
+        if self.is_body_seekable:
+            stream.seek(0)
+
+        parser = _MultipartParser(stream, boundary.encode('latin-1'),
+                                  self.body_chunk_size, self.max_form_fields,
+                                  self.max_form_bytes)
+        for part in parser:
+            yield part
+
+    @property
+    def form_parts(self):
+        """A ``MultiDict`` of field names to :class:`FormPart` instances,
+        parsed once from a ``multipart/form-data`` body.
+
+        Fields are kept in memory. Uploaded files are spooled to temporary
+        files if they are larger than :attr:`form_part_spool_limit`.
+
+        .. seealso:: :meth:`iter_parts`.
+        """
+        environ = self.environ
+        parts = environ.get('webapp2.form_parts')
+        if parts is None:
+            parts = MultiDict()
+            for part in self.iter_parts():
+                part.spool(self.form_part_spool_limit)
+                parts.add(part.name, part)
+
+            environ['webapp2.form_parts'] = parts
+
+        return parts
+
+    @property
+    def json(self):
+        """The body decoded from JSON with :mod:`webapp2_extras.json`.
+
+        The body is read in chunks of :attr:`body_chunk_size` bytes and
+        decoded once, until a new body is set. It is still available as
+        :attr:`body` afterwards.
+
+        :raises:
+            ``exc.HTTPBadRequest`` if the body is not valid JSON, or
+            ``exc.HTTPRequestEntityTooLarge`` if it is larger than
+            :attr:`max_json_size`.
+        """
+        environ = self.environ
+        cached = environ.get('webapp2.json')
+        if cached is not None and cached[0] is environ.get('wsgi.input'):
+            return cached[1]
+
+        from webapp2_extras import json as extras_json
+
+        data = self._read_body(self.max_json_size)
+        try:
+            value = extras_json.decode(data)
+        except ValueError:
+            abort(400, 'The request body is not valid JSON.')
+
+        # Setting the body replaces the input stream.
+        environ['webapp2.json'] = (environ.get('wsgi.input'), value)
+        return value
+
+    @json.setter
+    def json(self, value):
+        from webapp2_extras import json as extras_json
+
+        self.environ.pop('webapp2.json', None)
+        self.body = extras_json.encode(value).encode('utf-8')
+
+    @json.deleter
+    def json(self):
+        self.environ.pop('webapp2.json', None)
+        del self.body
+
+    def _read_body(self, limit=None):
+        """Returns the body as bytes, read in chunks of
+        :attr:`body_chunk_size` bytes.
+
+        The body is kept, so it can be read again.
+
+        :param limit:
+            Maximum size of the body, or None for no limit.
+        :raises:
+            ``exc.HTTPRequestEntityTooLarge`` if the body is larger than
+            `limit`.
+        """
+        length = self.content_length
+        if limit is not None and length is not None and length > limit:
+            abort(413, 'The request body is too large.')
+
+        if self.is_body_seekable:
+            data = self.body
+        else:
+            chunks = []
+            size = 0
+            read = self.body_file.read
+            chunk = read(self.body_chunk_size)
+            while chunk:
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    abort(413, 'The request body is too large.')
+
+                chunks.append(chunk)
+                chunk = read(self.body_chunk_size)
+
+            data = b''.join(chunks)
+            self.body = data
+
+        if limit is not None and len(data) > limit:
+            abort(413, 'The request body is too large.')
+
+        return data
+
     @classmethod
     def blank(cls, path, environ=None, base_url=None,
               headers=None, **kwargs):  # pragma: no cover
@@ -766,6 +1017,11 @@ class cached_property(object):
         if obj is None:
             return self
 
+        # Fast path: no locking once the value is set.
+        value = obj.__dict__.get(self.__name__, self._default_value)
+        if value is not self._default_value:
+            return value
+
         with self.lock:
             value = obj.__dict__.get(self.__name__, self._default_value)
             if value is self._default_value:
@@ -775,6 +1031,101 @@ class cached_property(object):
             return value
 
 
+class FormPart(object):
+    """A part of a ``multipart/form-data`` request body.
+
+    Parts are returned by :meth:`Request.iter_parts` and
+    :attr:`Request.form_parts`. They are file-like objects: the data can be
+    read with :meth:`read` or iterated in chunks.
+    """
+
+    #: Name of the form field.
+    name = None
+    #: Name of the uploaded file, or None if the part is a form field.
+    filename = None
+    #: The part content type, or None if not set.
+    content_type = None
+    #: A dictionary of part headers, with lower case names.
+    headers = None
+    #: The file-like object the data is read from. Until :meth:`spool` is
+    #: called, it reads from the request body.
+    file = None
+    #: Number of bytes read at a time when the part is iterated.
+    chunk_size = 64 * 1024
+
+    def __init__(self, headers, file, chunk_size=None):
+        """Initializes this part.
+
+        :param headers:
+            A dictionary of part headers, with lower case names.
+        :param file:
+            A file-like object to read the data from.
+        :param chunk_size:
+            Number of bytes read at a time when the part is iterated.
+        """
+        self.headers = headers
+        self.file = file
+        if chunk_size:
+            self.chunk_size = chunk_size
+        disposition, params = cgi.parse_header(
+            headers.get('content-disposition', ''))
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+        if 'content-type' in headers:
+            self.content_type = headers['content-type']
+
+    def read(self, size=-1):
+        """Reads up to `size` bytes of data, or all of it if `size` is
+        negative.
+        """
+        return self.file.read(size)
+
+    def __iter__(self):
+        read = self.file.read
+        chunk = read(self.chunk_size)
+        while chunk:
+            yield chunk
+            chunk = read(self.chunk_size)
+
+    @cached_property
+    def value(self):
+        """The data of a file, or the decoded text of a form field."""
+        data = self.read()
+        if self.filename is not None:
+            return data
+
+        charset = 'utf-8'
+        if self.content_type:
+            charset = cgi.parse_header(self.content_type)[1].get(
+                'charset', charset)
+
+        return data.decode(charset)
+
+    def spool(self, max_size=0):
+        """Reads the remaining data, so it is kept after the next part is
+        parsed.
+
+        :param max_size:
+            Uploaded files larger than this number of bytes are written to a
+            temporary file. If 0, files are kept in memory. Form fields are
+            always kept in memory.
+        """
+        if self.filename is not None and max_size:
+            spooled = tempfile.SpooledTemporaryFile(max_size=max_size)
+        else:
+            spooled = six.BytesIO()
+
+        for chunk in self:
+            spooled.write(chunk)
+
+        spooled.seek(0)
+        self.file = spooled
+
+    def __repr__(self):
+        return '<FormPart(name=%r, filename=%r, content_type=%r)>' % \
+               (self.name, self.filename, self.content_type)
+
+
 class BaseRoute(object):
     """Interface for URI routes."""
 
@@ -825,6 +1176,20 @@ class BaseRoute(object):
         """
         raise NotImplementedError()
 
+    def get_match_path(self, request):
+        """Returns the unquoted request path to be matched.
+
+        Custom routes should use this instead of unquoting
+        ``request.path``: with a :class:`Request` the path is only decoded
+        once for all routes.
+
+        :param request:
+            A :class:`Request` instance.
+        :returns:
+            The unquoted request path.
+        """
+        return _get_match_path(request)
+
     def build(self, request, args, kwargs):
         """Returns a URI for this route.
 
@@ -893,7 +1258,7 @@ class SimpleRoute(BaseRoute):
 
         .. seealso:: :meth:`BaseRoute.match`.
         """
-        match = self.regex.match(unquote(request.path))
+        match = self.regex.match(self.get_match_path(request))
         if match:
             return self, match.groups(), {}
 
@@ -901,6 +1266,93 @@ class SimpleRoute(BaseRoute):
         return '<SimpleRoute(%r, %r)>' % (self.template, self.handler)
 
 
+class BaseConverter(object):
+    """Converts a route variable to a Python value when a route matches, and
+    back to a string when a URI is built.
+
+    Converters are referenced by name in route templates, e.g.
+    ``'/items/<item_id:int>'``. See :attr:`Route.converters`.
+    """
+
+    #: Regular expression that matches the variable.
+    regex = '[^/]+'
+
+    def to_python(self, value):
+        """Returns the value passed to the handler.
+
+        :param value:
+            The string matched by :attr:`regex`.
+        :returns:
+            The converted value.
+        :raises:
+            ``ValueError`` if the value is not valid. The route doesn't match
+            in this case.
+        """
+        return value
+
+    def to_url(self, value):
+        """Returns the string used to build a URI.
+
+        The result is checked against :attr:`regex` when the URI is built,
+        unless it is built with ``_trusted=True``.
+
+        :param value:
+            The value passed to build the URI.
+        :returns:
+            The string for the URI.
+        :raises:
+            ``ValueError`` if the value is not valid.
+        """
+        return str(value)
+
+
+class IntConverter(BaseConverter):
+    """Converts non-negative integers."""
+
+    regex = r'\d+'
+
+    def to_python(self, value):
+        return int(value)
+
+    def to_url(self, value):
+        value = int(value)
+        if value < 0:
+            raise ValueError(value)
+
+        return str(value)
+
+
+class UUIDConverter(BaseConverter):
+    """Converts UUIDs in their canonical form to :class:`uuid.UUID`."""
+
+    regex = ('[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+             '[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+    def to_python(self, value):
+        return uuid.UUID(value)
+
+    def to_url(self, value):
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(value)
+
+        return str(value)
+
+
+class DateConverter(BaseConverter):
+    """Converts ``YYYY-MM-DD`` dates to :class:`datetime.date`."""
+
+    regex = r'\d{4}-\d{2}-\d{2}'
+
+    def to_python(self, value):
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+    def to_url(self, value):
+        if isinstance(value, six.string_types):
+            value = self.to_python(value)
+
+        return '%04d-%02d-%02d' % (value.year, value.month, value.day)
+
+
 class Route(BaseRoute):
     """A route definition that maps a URI path to a handler.
 
@@ -914,16 +1366,30 @@ class Route(BaseRoute):
     methods = None
     #: Sequence of allowed URI schemes. If not set, all schemes are allowed.
     schemes = None
+    #: A dictionary of request limits that replace the ones of the app. See
+    #: :attr:`WSGIApplication.limits`.
+    limits = None
+    #: Converters that can be referenced by name in templates, as
+    #: ``<name:converter>``. To register a converter, add an instance of
+    #: :class:`BaseConverter` to this mapping, or set a new mapping in a
+    #: subclass.
+    converters = {
+        'int': IntConverter(),
+        'uuid': UUIDConverter(),
+        'date': DateConverter(),
+    }
     # Lazy properties extracted from the route template.
     regex = None
     reverse_template = None
     variables = None
     args_count = 0
     kwargs_count = 0
+    _extractor = None
+    _converters = None
 
     def __init__(self, template, handler=None, name=None, defaults=None,
                  build_only=False, handler_method=None, methods=None,
-                 schemes=None):
+                 schemes=None, limits=None):
         """Initializes this route.
 
         :param template:
@@ -942,6 +1408,13 @@ class Route(BaseRoute):
             The same template can mix parts with name, regular expression or
             both.
 
+            The regular expression can also be the name of one of the
+            :attr:`converters`, like ``int``, ``uuid`` or ``date``. The
+            value is then converted before it is passed to the handler, and
+            converted back when a URI is built::
+
+                Route('/blog/<day:date>/<post_id:int>', handler=PostHandler)
+
             If the name is set, the value of the matched regular expression
             is passed as keyword argument to the handler. Otherwise it is
             passed as positional argument.
@@ -987,12 +1460,17 @@ class Route(BaseRoute):
         :param schemes:
             A sequence of URI schemes, e.g., ``['http']`` or ``['https']``.
             If set, the route will only match requests with these schemes.
+        :param limits:
+            A dictionary of request limits for this route, e.g.,
+            ``{'max_body_size': 10 * 1024 * 1024}``. Limits not set here
+            are the ones of the app. See :attr:`WSGIApplication.limits`.
         """
         super(Route, self).__init__(template, handler=handler, name=name,
                                     build_only=build_only)
         self.defaults = defaults or {}
         self.methods = methods
         self.schemes = schemes
+        self.limits = limits
         if isinstance(handler, six.string_types) and ':' in handler:
             if handler_method:
                 raise ValueError(
@@ -1008,7 +1486,11 @@ class Route(BaseRoute):
         """Lazy route template parser."""
         regex, self.reverse_template, self.args_count, self.kwargs_count, \
             self.variables = _parse_route_template(self.template,
-                                                   default_sufix='[^/]+')
+                                                   default_sufix='[^/]+',
+                                                   converters=self.converters)
+        self._converters = _get_template_converters(self.template,
+                                                    self.converters)
+        self._extractor = _get_route_extractor(regex, self._converters)
         return regex
 
     def match(self, request):
@@ -1020,8 +1502,8 @@ class Route(BaseRoute):
 
         .. seealso:: :meth:`BaseRoute.match`.
         """
-        match = self.regex.match(unquote(request.path))
-        if not match or self.schemes and request.scheme not in self.schemes:
+        match = self._match_variables(request)
+        if match is None:
             return None
 
         if self.methods and request.method not in self.methods:
@@ -1029,8 +1511,29 @@ class Route(BaseRoute):
             # methods can be tried.
             raise exc.HTTPMethodNotAllowed()
 
-        args, kwargs = _get_route_variables(match, self.defaults.copy())
-        return self, args, kwargs
+        return (self,) + match
+
+    def _match_variables(self, request):
+        """Matches the path, scheme and converters of this route, ignoring
+        the allowed methods.
+
+        :returns:
+            A tuple ``(args, kwargs)``, or None if the route doesn't match.
+        """
+        match = self.regex.match(self.get_match_path(request))
+        if not match or self.schemes and request.scheme not in self.schemes:
+            return None
+
+        extractor = self._extractor
+        if extractor is None:
+            # The regex was set by a subclass.
+            return _get_route_variables(match, self.defaults.copy())
+
+        try:
+            return extractor(match, self.defaults)
+        except ValueError:
+            # A converter rejected a value.
+            return None
 
     def build(self, request, args, kwargs):
         """Returns a URI for this route.
@@ -1041,49 +1544,65 @@ class Route(BaseRoute):
         netloc = kwargs.pop('_netloc', None)
         anchor = kwargs.pop('_fragment', None)
         full = kwargs.pop('_full', False) and not scheme and not netloc
+        trusted = kwargs.pop('_trusted', False)
 
         if full or scheme or netloc:
             netloc = netloc or request.host
             scheme = scheme or request.scheme
 
-        path, query = self._build(args, kwargs)
+        path, query = self._build(args, kwargs, trusted)
         return _urlunsplit(scheme, netloc, path, query, anchor)
 
-    def _build(self, args, kwargs):
+    def _build(self, args, kwargs, trusted=False):
         """Returns the URI path for this route.
 
+        :param trusted:
+            If True, values are not validated against the variable regexes.
+            Variables with a converter are converted with
+            :meth:`BaseConverter.to_url` first.
         :returns:
             A tuple ``(path, kwargs)`` with the built URI path and extra
             keywords to be used as URI query arguments.
         """
-        # Access self.regex just to set the lazy properties.
-        regex = self.regex
-        variables = self.variables
-        if self.args_count:
-            for index, value in enumerate(args):
-                key = '__%d__' % index
-                if key in variables:
-                    kwargs[key] = value
+        return self._builder(args, kwargs, trusted)
 
-        values = {}
-        for name, regex in six.iteritems(variables):
-            value = kwargs.pop(name, self.defaults.get(name))
-            if value is None:
-                raise KeyError('Missing argument "%s" to build URI.' %
-                               name.strip('_'))
+    @cached_property
+    def _builder(self):
+        """Lazy URI path builder, compiled from the route template."""
+        # Access self.regex just to set the lazy properties.
+        self.regex
+        return _get_route_builder(self)
 
-            if not isinstance(value, six.string_types):
-                value = str(value)
+    @cached_property
+    def _literals(self):
+        """The literal prefix of the template, before its first variable,
+        and the literal tail, after its last one.
+        """
+        parts, tail = _split_route_template(self.template)
+        if parts:
+            return parts[0][0], tail
 
-            if not regex.match(value):
-                raise ValueError(
-                    'URI building error: Value "%s" is not supported'
-                    'for argument "%s".' % (value, name.strip('_'))
-                )
+        return self.template, self.template
 
-            values[name] = value
+    @cached_property
+    def _static_prefix(self):
+        """The literal prefix of the template if the route can be indexed
+        by it, or None. See :func:`_get_static_prefix`.
+        """
+        if self._matches_template:
+            return self._literals[0]
 
-        return self.reverse_template % values, kwargs
+    @property
+    def _matches_template(self):
+        """True if :meth:`match` only matches the regex parsed from the
+        template against the default path, so the route can be indexed by
+        its static prefix.
+        Subclasses that override :meth:`match` can return True if they
+        still do.
+        """
+        return six.get_unbound_function(type(self).match) is \
+            six.get_unbound_function(Route.match) and \
+            _uses_default_regex(self)
 
     def __repr__(self):
         return '<Route(%r, %r, name=%r, defaults=%r, build_only=%r)>' % \
@@ -1143,24 +1662,93 @@ class Webapp2HandlerAdapter(BaseHandlerAdapter):
     """An adapter to dispatch a ``webapp2.RequestHandler``.
 
     The handler is constructed then ``dispatch()`` is called.
+
+    For :class:`RequestHandler` subclasses that don't override
+    ``__init__()``, ``initialize()`` or ``dispatch()``, if the route doesn't
+    set a handler method and the handler doesn't implement the request
+    method, a 405 error with the ``Allow`` header is raised without
+    constructing the handler. This
+    includes ``OPTIONS`` requests to handlers without an ``options()``
+    method.
     """
 
+    #: HTTP methods implemented by the handler, out of the allowed methods of
+    #: the app of the last request, or None if they are not checked before
+    #: constructing the handler.
+    methods = None
+    #: A tuple ``(allowed_methods, methods, allow)`` computed for the allowed
+    #: methods of an app, or None.
+    _methods = None
+
+    def __init__(self, handler):
+        super(Webapp2HandlerAdapter, self).__init__(handler)
+        # Handlers that run their own code when they are constructed or
+        # dispatched always are.
+        self._checks_methods = (
+            isinstance(handler, type) and
+            issubclass(handler, RequestHandler) and
+            all(six.get_unbound_function(getattr(handler, name)) is
+                six.get_unbound_function(getattr(RequestHandler, name))
+                for name in ('__init__', 'initialize', 'dispatch')))
+
     def __call__(self, request, response):
+        if self._checks_methods and not request.route.handler_method:
+            app = request.app
+            allowed_methods, methods, allow = self._get_methods(
+                WSGIApplication.allowed_methods if app is None
+                else app.allowed_methods)
+            if request.method not in methods:
+                # 405 Method Not Allowed.
+                abort(405, headers=[('Allow', allow)])
+
         handler = self.handler(request, response)
         return handler.dispatch()
 
+    def _get_methods(self, allowed_methods):
+        """Returns the cached ``(allowed_methods, methods, allow)`` tuple,
+        computed again if the allowed methods changed.
+        """
+        cached = self._methods
+        if cached is None or cached[0] is not allowed_methods:
+            methods = _get_handler_methods(self.handler, allowed_methods)
+            cached = (allowed_methods, frozenset(methods), ', '.join(methods))
+            self._methods = cached
+            self.methods = cached[1]
+
+        return cached
+
 
 class Router(object):
     """A URI router used to match, dispatch and build URIs."""
 
     #: Class used when the route is set as a tuple.
     route_class = SimpleRoute
-    #: All routes that can be matched.
-    match_routes = None
-    #: All routes that can be built.
-    build_routes = None
     #: Handler classes imported lazily.
     handlers = None
+    #: Maximum number of match results kept by :meth:`default_dispatcher`,
+    #: keyed by request path, method, scheme and host. If 0 (the default)
+    #: match results are not cached. Set it only if no route depends on
+    #: other request attributes.
+    match_cache_size = 0
+    #: Maximum number of URIs kept by :meth:`default_builder`, keyed by
+    #: route name and arguments. If 0 (the default) URIs are not cached.
+    build_cache_size = 0
+    #: Number of matches after which :meth:`reorder_routes` is called. If
+    #: 0 (the default) route hits are not counted.
+    reorder_interval = 0
+    #: Hits per match route, counted if :attr:`reorder_interval` is set.
+    _hits = None
+    #: Matches counted since the last reordering.
+    _hit_count = 0
+    #: The current :class:`_RouteTable`, read through :attr:`_table`. It is
+    #: never modified once set: changes build a new table and replace it.
+    _current = None
+    #: A copy of the current table with the routes added since it was last
+    #: read. It is set as the current table on the next read, so a batch of
+    #: :meth:`add` calls copies the table once.
+    _pending = None
+    #: True while the routes passed to the constructor are added.
+    _building = False
 
     def __init__(self, routes=None):
         """Initializes the router.
@@ -1169,29 +1757,255 @@ class Router(object):
             A sequence of :class:`Route` instances or, for simple routes,
             tuples ``(regex, handler)``.
         """
-        self.match_routes = []
-        self.build_routes = {}
         self.handlers = {}
+        self._handlers_lock = threading.RLock()
+        self._hits = {}
+        self._table_lock = threading.RLock()
+        self._table = _RouteTable()
         if routes:
-            for route in routes:
-                self.add(route)
+            # No other thread uses the router yet, so the table is
+            # updated in place.
+            self._building = True
+            try:
+                for route in routes:
+                    self.add(route)
+            finally:
+                self._building = False
+
+    @property
+    def match_routes(self):
+        """All routes that can be matched, as a tuple. To change them use
+        :meth:`add` or set a new sequence, which rebuilds the indexes.
+        """
+        table = self._table
+        routes = table.match_tuple
+        if routes is None or len(routes) != len(table.match_routes):
+            table.match_tuple = routes = tuple(table.match_routes)
+
+        return routes
+
+    @match_routes.setter
+    def match_routes(self, match_routes):
+        with self._table_lock:
+            self._table = self._table.replace(match_routes=match_routes)
+
+    @property
+    def build_routes(self):
+        """All routes that can be built, by name. Don't modify it: use
+        :meth:`add` or set a new dictionary.
+        """
+        return self._table.build_routes
+
+    @build_routes.setter
+    def build_routes(self, build_routes):
+        with self._table_lock:
+            self._table = self._table.replace(build_routes=build_routes)
+
+    @property
+    def _table(self):
+        """The current :class:`_RouteTable`, with the routes added since it
+        was last read.
+        """
+        if self._pending is not None:
+            with self._table_lock:
+                if self._pending is not None:
+                    self._current = self._pending
+                    self._pending = None
+
+        return self._current
+
+    @_table.setter
+    def _table(self, table):
+        self._current = table
+
+    @property
+    def _index(self):
+        return self._table.index
+
+    @property
+    def _trie(self):
+        return self._table.trie
+
+    @property
+    def _combined(self):
+        return self._table.combined
 
     def add(self, route):
         """Adds a route to this router.
 
+        Routes can be added while other threads match requests: the route
+        table is copied and updated, and replaces the current one in a
+        single step the next time the router is used, with new indexes and
+        empty caches. Requests that already started keep using the previous
+        table. Routes added between two uses of the router share one copy.
+
         :param route:
             A :class:`Route` instance or, for simple routes, a tuple
             ``(regex, handler)``.
         """
-        if isinstance(route, tuple):
-            # Exceptional case: simple routes defined as a tuple.
-            route = self.route_class(*route)
+        self.add_routes([route])
 
-        for r in route.get_match_routes():
-            self.match_routes.append(r)
+    def add_routes(self, routes):
+        """Adds several routes to this router.
 
-        for name, r in route.get_build_routes():
-            self.build_routes[name] = r
+        .. seealso:: :meth:`add`.
+
+        :param routes:
+            A sequence of :class:`Route` instances or, for simple routes,
+            tuples ``(regex, handler)``.
+        """
+        routes = [self.route_class(*route) if isinstance(route, tuple)
+                  else route for route in routes]
+        with self._table_lock:
+            if self._building:
+                table = self._current
+            elif self._pending is not None:
+                table = self._pending
+            else:
+                table = self._current.copy()
+
+            for route in routes:
+                table.add(route)
+
+            if not self._building:
+                self._pending = table
+
+    def compile(self, fail_fast=False, methods=None):
+        """Resolves all lazy state of the routes in advance.
+
+        Route regexes and URI builders are compiled, string handlers are
+        imported and adapted and the match indexes are built, so the first
+        request to each route doesn't pay for it. Call it before forking
+        workers or from a warmup request.
+
+        :param fail_fast:
+            If True, the first handler that fails to import raises an
+            :class:`ImportStringError`. Otherwise failures are reported and
+            the handler is imported again when the route is dispatched.
+        :param methods:
+            HTTP methods to prepare the match indexes for. Default is
+            :attr:`WSGIApplication.allowed_methods`.
+        :returns:
+            A dictionary with the number of ``routes``, ``handlers`` and
+            ``builders`` prepared, the ``errors`` as a list of tuples
+            ``(route, exception)`` and the ``timings`` in seconds for
+            ``regex``, ``handlers``, ``builders``, ``indexes`` and
+            ``total``.
+        """
+        if methods is None:
+            methods = WSGIApplication.allowed_methods
+
+        report = {
+            'routes': 0,
+            'handlers': 0,
+            'builders': 0,
+            'errors': [],
+            'timings': {},
+        }
+        timings = report['timings']
+        start = timer = timeit.default_timer()
+
+        table = self._table
+        routes = list(_iter_match_routes(table.match_routes))
+        for route in routes:
+            # Access the lazy regex, if any, to compile it.
+            getattr(route, 'regex', None)
+
+        report['routes'] = len(routes)
+        now = timeit.default_timer()
+        timings['regex'], timer = now - timer, now
+
+        for route in routes:
+            # Nested route containers have no handler of their own.
+            if getattr(route, 'handler', None) is None or \
+                    getattr(route, 'handler_adapter', None) is not None:
+                continue
+
+            try:
+                self._load_adapter(route)
+                report['handlers'] += 1
+            except ImportStringError as e:
+                if fail_fast:
+                    raise
+
+                report['errors'].append((route, e))
+
+        now = timeit.default_timer()
+        timings['handlers'], timer = now - timer, now
+
+        for route in six.itervalues(table.build_routes):
+            if isinstance(route, Route):
+                route._builder
+                report['builders'] += 1
+
+        now = timeit.default_timer()
+        timings['builders'], timer = now - timer, now
+
+        table.index.prepare(methods)
+        func = getattr(self.match, '__func__', None)
+        if func is six.get_unbound_function(Router.trie_matcher):
+            table.trie = _RouteTrie(table.match_routes)
+        elif func is six.get_unbound_function(Router.combined_matcher):
+            combined = _CombinedRoutes(table.match_routes)
+            combined.prepare(methods)
+            table.combined = combined
+
+        now = timeit.default_timer()
+        timings['indexes'] = now - timer
+        timings['total'] = now - start
+        return report
+
+    def match_many(self, paths, method='GET', host=None, scheme='http',
+                   cache_size=10000):
+        """Matches many paths, without a :class:`Request` for each one.
+
+        This is useful to resolve logged paths to route names offline or
+        to warm caches, and doesn't need a :class:`WSGIApplication`::
+
+            for path, match in zip(paths, router.match_many(paths)):
+                if match is not None:
+                    name, args, kwargs = match
+
+        Routes are matched against a minimal request object that only has
+        ``method``, ``scheme``, ``host``, ``path``, ``match_path`` and a
+        basic ``environ``. Routes that match other request attributes need
+        a real request.
+
+        :param paths:
+            An iterable of paths, quoted as in a request URI. A query string
+            is ignored.
+        :param method:
+            The HTTP method to match.
+        :param host:
+            The host to match, with an optional port. Default is
+            ``localhost``.
+        :param scheme:
+            The URI scheme to match.
+        :param cache_size:
+            Maximum number of distinct paths whose results are kept, so
+            repeated paths are only matched once.
+        :returns:
+            A generator of tuples ``(route_name, args, kwargs)``, or None for
+            paths that don't match, in the same order as `paths`.
+        """
+        host = host or 'localhost'
+        cache = _LRUCache(cache_size)
+        for path in paths:
+            rv = cache.get(path)
+            if rv is None:
+                request = _MatchRequest(path, method, host, scheme)
+                try:
+                    route, args, kwargs = self.match(request)
+                    rv = (route.name, args, kwargs)
+                except (exc.HTTPNotFound, exc.HTTPMethodNotAllowed):
+                    rv = False
+
+                cache.set(path, rv)
+
+            if rv is False:
+                yield None
+            else:
+                yield rv[0], rv[1], rv[2].copy()
 
     def set_matcher(self, func):
         """Sets the function called to match URIs.
@@ -1238,6 +2052,10 @@ class Router(object):
 
         The first one that matches is returned.
 
+        Routes without variables in the template are indexed by path when
+        they are added, so a request for one of these paths only tries the
+        routes that can match it, in the order they were added.
+
         :param request:
             A :class:`Request` instance.
         :returns:
@@ -1247,16 +2065,86 @@ class Router(object):
             ``exc.HTTPMethodNotAllowed`` if a route matched but the HTTP
             method was not allowed.
         """
+        path = _get_match_path(request)
+        routes, excluded = self._table.index.lookup(path, request.method)
+        return self._match_routes(routes, request, excluded)
+
+    def trie_matcher(self, request):
+        """Matches routes using an index of their literal path segments.
+
+        This is an alternative to :meth:`default_matcher` for large route
+        tables. :class:`Route` templates are indexed by the path segments
+        that precede their first variable, so only routes whose static
+        prefix fits the request path are tried. Other routes (e.g.,
+        :class:`SimpleRoute` or custom routes) are always tried. The first
+        route that matches in declaration order is returned, exactly as in
+        :meth:`default_matcher`. To use it::
+
+            app.router.set_matcher(webapp2.Router.trie_matcher)
+
+        .. seealso:: :meth:`default_matcher`.
+        """
+        table = self._table
+        trie = table.trie
+        if trie is None:
+            table.trie = trie = _RouteTrie(table.match_routes)
+
+        return self._match_routes(trie.lookup(_get_match_path(request)),
+                                  request)
+
+    def combined_matcher(self, request):
+        """Matches routes using a single regex per HTTP method.
+
+        This is an alternative to :meth:`default_matcher` for tables with
+        many routes with variables. The regexes of consecutive
+        :class:`Route` instances that allow the request method are combined
+        into alternations of a few dozen routes, so a single ``re.match()``
+        call tries all of them and the variables are read from the group
+        offsets. Routes that can't be combined (e.g.,
+        :class:`SimpleRoute`, custom routes or variables with named groups
+        or backreferences) are tried on their own, in declaration order. To
+        use it::
+
+            app.router.set_matcher(webapp2.Router.combined_matcher)
+
+        .. seealso:: :meth:`default_matcher`.
+        """
+        table = self._table
+        combined = table.combined
+        if combined is None:
+            table.combined = combined = _CombinedRoutes(table.match_routes)
+
+        route, match = combined.match(request)
+        if self.reorder_interval:
+            self._count_hit(route, request)
+
+        return match
+
+    def _match_routes(self, routes, request, excluded=()):
+        """Returns the first match from a sequence of routes.
+
+        :param excluded:
+            :class:`Route` instances left out because they don't allow the
+            request method. They are only checked on a miss, to tell a 405
+            from a 404.
+        :raises:
+            ``exc.HTTPNotFound`` if no route matched or
+            ``exc.HTTPMethodNotAllowed`` if a route matched but the HTTP
+            method was not allowed.
+        """
         method_not_allowed = False
-        for route in self.match_routes:
+        for route in routes:
             try:
                 match = route.match(request)
                 if match:
+                    if self.reorder_interval:
+                        self._count_hit(route, request)
+
                     return match
             except exc.HTTPMethodNotAllowed:
                 method_not_allowed = True
 
-        if method_not_allowed:
+        if method_not_allowed or _match_any_route(excluded, request):
             raise exc.HTTPMethodNotAllowed()
 
         raise exc.HTTPNotFound()
@@ -1287,14 +2175,39 @@ class Router(object):
               defined, an absolute URI is always returned.
             - **_fragment**: If set, appends a fragment (or "anchor") to the
               generated URI.
+            - **_trusted**: If True, values are not validated against the
+              regexes of the route variables. Use it only for values
+              generated by the application, e.g., ids read from the
+              datastore. Only :class:`Route` uses it: for other routes it
+              is removed.
         :returns:
             An absolute or relative URI.
         """
-        route = self.build_routes.get(name)
+        table = self._table
+        route = table.build_routes.get(name)
         if route is None:
             raise KeyError('Route named %r is not defined.' % name)
 
-        return route.build(request, args, kwargs)
+        if not isinstance(route, Route):
+            kwargs.pop('_trusted', None)
+
+        if not self.build_cache_size:
+            return route.build(request, args, kwargs)
+
+        key = _get_build_key(route, name, args, kwargs)
+        if key is None:
+            return route.build(request, args, kwargs)
+
+        cache = table.build_cache
+        if cache is None:
+            table.build_cache = cache = _LRUCache(self.build_cache_size)
+
+        uri = cache.get(key)
+        if uri is None:
+            uri = route.build(request, args, kwargs)
+            cache.set(key, uri)
+
+        return uri
 
     def default_dispatcher(self, request, response):
         """Dispatches a handler.
@@ -1304,16 +2217,35 @@ class Router(object):
         :param response:
             A :class:`Response` instance.
         :raises:
-            ``exc.HTTPNotFound`` if no route matched or
+            ``exc.HTTPNotFound`` if no route matched,
             ``exc.HTTPMethodNotAllowed`` if a route matched but the HTTP
-            method was not allowed.
+            method was not allowed or ``exc.HTTPRequestEntityTooLarge`` if
+            the ``Content-Length`` exceeds the body size limit.
         :returns:
             The returned value from the handler.
         """
-        route, args, kwargs = rv = self.match(request)
+        route, args, kwargs = rv = self._cached_match(request)
         request.route, request.route_args, request.route_kwargs = rv
+        _set_request_limits(request, route)
+        if request.decode_content:
+            _set_content_decoding(request)
 
         if route.handler_adapter is None:
+            self._load_adapter(route)
+
+        return route.handler_adapter(request, response)
+
+    def _load_adapter(self, route):
+        """Imports the handler of a route, if needed, and sets its adapter.
+
+        Concurrent requests to a cold route wait for a single import and
+        adaptation. Once ``route.handler_adapter`` is set, callers don't
+        get here and no lock is taken.
+        """
+        with self._handlers_lock:
+            if route.handler_adapter is not None:
+                return
+
             handler = route.handler
             if isinstance(handler, six.string_types):
                 if handler not in self.handlers:
@@ -1321,19 +2253,147 @@ class Router(object):
                 else:
                     handler = self.handlers[handler]
 
+            # Set last, so other threads never see a partial adapter.
             route.handler_adapter = self.adapt(handler)
 
-        return route.handler_adapter(request, response)
+    def match_cache_info(self):
+        """Returns statistics about the match cache.
 
-    def default_adapter(self, handler):
-        """Adapts a handler for dispatching.
+        .. seealso:: :attr:`match_cache_size`.
 
-        Because handlers use or implement different dispatching mechanisms,
-        they can be wrapped to use a unified API for dispatching.
-        This way webapp2 can support, for example, a :class:`RequestHandler`
-        class and function views or, for compatibility purposes, a
-        ``webapp.RequestHandler`` class. The adapters follow the same router
-        dispatching API but dispatch each handler type differently.
+        :returns:
+            A dictionary with ``hits``, ``misses``, ``evictions``, ``size``
+            and ``maxsize``, or None if the cache is not enabled.
+        """
+        cache = self._table.match_cache
+        if cache is not None:
+            return cache.info()
+
+    def reorder_routes(self, max_passes=None):
+        """Moves the most matched routes ahead in :attr:`match_routes`.
+
+        Routes are sorted by the hits counted since :attr:`reorder_interval`
+        was set, but a route is only moved ahead of routes that it can't
+        overlap with: their literal prefixes or suffixes differ, or they
+        allow different HTTP methods or schemes. So the same route matches
+        each request, and the most used ones are tried first.
+
+        Each pass goes from the last route to the first and swaps
+        neighbours that are out of order. Every :attr:`reorder_interval`
+        matches a single pass is made, so the request that triggers it
+        only pays for a number of checks linear in the number of routes;
+        the order settles over the next intervals. Only the index used by
+        the current matcher is updated: the others give the same results
+        in the old order.
+
+        :param max_passes:
+            Maximum number of passes, or None to pass until the order
+            doesn't change.
+        :returns:
+            True if the order changed.
+        """
+        if not self._table_lock.acquire(False):
+            # Another thread is changing the table.
+            return False
+
+        try:
+            self._hit_count = 0
+            hits = self._hits
+            table = self._table
+            order = list(table.match_routes)
+            passes = 0
+            changed = True
+            while changed and (max_passes is None or passes < max_passes):
+                passes += 1
+                changed = False
+                for i in range(len(order) - 2, -1, -1):
+                    route, next_route = order[i], order[i + 1]
+                    if hits.get(route, 0) < hits.get(next_route, 0) and \
+                            _are_disjoint(route, next_route):
+                        order[i], order[i + 1] = next_route, route
+                        changed = True
+
+            if order == table.match_routes:
+                return False
+
+            self._table = table.reorder(order,
+                                        getattr(self.match, '__func__', None))
+            return True
+        finally:
+            self._table_lock.release()
+
+    def match_order_info(self):
+        """Returns the match routes in the current order with their hits.
+
+        .. seealso:: :attr:`reorder_interval`.
+
+        :returns:
+            A list of tuples ``(route, hits)``.
+        """
+        hits = self._hits
+        return [(route, hits.get(route, 0)) for route in self.match_routes]
+
+    def _count_hit(self, route, request):
+        """Counts a hit for a match route and makes a reordering pass if
+        due. Paths matched by :meth:`match_many` are not counted.
+        """
+        if isinstance(request, _MatchRequest):
+            return
+
+        if isinstance(route, _HostRoutes):
+            # Count the route of the group that matched.
+            route = route.match_route(request)[0]
+
+        hits = self._hits
+        hits[route] = hits.get(route, 0) + 1
+        self._hit_count += 1
+        if self._hit_count >= self.reorder_interval:
+            self.reorder_routes(max_passes=1)
+
+    def build_cache_info(self):
+        """Returns statistics about the URI build cache.
+
+        .. seealso:: :attr:`build_cache_size`.
+
+        :returns:
+            A dictionary with ``hits``, ``misses``, ``evictions``, ``size``
+            and ``maxsize``, or None if the cache is not enabled.
+        """
+        cache = self._table.build_cache
+        if cache is not None:
+            return cache.info()
+
+    def _cached_match(self, request):
+        """Calls :meth:`match`, using the match cache if it is enabled."""
+        table = self._table
+        cache = table.match_cache
+        if cache is None:
+            if not self.match_cache_size:
+                return self.match(request)
+
+            table.match_cache = cache = _LRUCache(self.match_cache_size)
+
+        key = (_get_match_path(request), request.method, request.scheme,
+               request.host, request.environ.get('SERVER_NAME'))
+        rv = cache.get(key)
+        if rv is None:
+            route, args, kwargs = rv = self.match(request)
+            cache.set(key, (route, args, kwargs.copy()))
+            return rv
+
+        # Handlers get a copy, so cached keywords are never modified.
+        route, args, kwargs = rv
+        return route, args, kwargs.copy()
+
+    def default_adapter(self, handler):
+        """Adapts a handler for dispatching.
+
+        Because handlers use or implement different dispatching mechanisms,
+        they can be wrapped to use a unified API for dispatching.
+        This way webapp2 can support, for example, a :class:`RequestHandler`
+        class and function views or, for compatibility purposes, a
+        ``webapp.RequestHandler`` class. The adapters follow the same router
+        dispatching API but dispatch each handler type differently.
 
         :param handler:
             A handler callable.
@@ -1354,7 +2414,7 @@ class Router(object):
         return adapter(handler)
 
     def __repr__(self):
-        routes = self.match_routes + [
+        routes = list(self.match_routes) + [
             v for k, v in six.iteritems(self.build_routes)
             if v not in self.match_routes
         ]
@@ -1481,6 +2541,12 @@ class WSGIApplication(object):
     #: Allowed request methods.
     allowed_methods = frozenset(('GET', 'POST', 'HEAD', 'OPTIONS', 'PUT',
                                  'DELETE', 'TRACE'))
+    #: Request limits, checked before the body is read: a dictionary with
+    #: any of ``max_body_size``, ``max_form_fields``, ``max_form_bytes``,
+    #: ``max_json_size`` and ``max_decoded_size`` (see :class:`Request`).
+    #: Routes can replace them with their own ``limits``. Requests that
+    #: exceed a limit get a 413 error.
+    limits = None
     #: Class used for the request object.
     request_class = Request
     #: Class used for the response object.
@@ -1667,6 +2733,26 @@ class WSGIApplication(object):
         else:  # pragma: no cover
             handlers.CGIHandler().run(self)
 
+    def warmup(self, fail_fast=False):
+        """Compiles routes and imports handlers before the first request.
+
+        This is a shortcut to :meth:`Router.compile`, using the
+        :attr:`allowed_methods` of this app. It can be called after the app
+        is created, before workers are forked, or from a warmup request
+        handler::
+
+            app = webapp2.WSGIApplication(routes)
+            app.warmup(fail_fast=True)
+
+        :param fail_fast:
+            If True, raises an :class:`ImportStringError` if a handler fails
+            to import.
+        :returns:
+            The report returned by :meth:`Router.compile`.
+        """
+        return self.router.compile(fail_fast=fail_fast,
+                                   methods=self.allowed_methods)
+
     def get_response(self, *args, **kwargs):
         """Creates a request and returns a response for this app.
 
@@ -1945,16 +3031,55 @@ def _urlunsplit(scheme=None, netloc=None, path=None, query=None,
     return urlunsplit((scheme, netloc, path, query, fragment))
 
 
-def _get_handler_methods(handler):
+def _get_match_path(request):
+    """Returns the unquoted path of a request.
+
+    This also supports request objects that don't define
+    :attr:`Request.match_path`.
+    """
+    try:
+        return request.match_path
+    except AttributeError:
+        return unquote(request.path)
+
+
+class _MatchRequest(object):
+    """A minimal request used by :meth:`Router.match_many`."""
+
+    def __init__(self, path, method, host, scheme):
+        self.path = path.split('?', 1)[0]
+        self.match_path = unquote(self.path)
+        self.method = method
+        self.scheme = scheme
+        self.host = host
+        server_name, _, port = host.partition(':')
+        self.environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': self.match_path,
+            'HTTP_HOST': host,
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': port or ('443' if scheme == 'https' else '80'),
+            'wsgi.url_scheme': scheme,
+        }
+
+
+def _get_handler_methods(handler, allowed_methods=None):
     """Returns a list of HTTP methods supported by a handler.
 
     :param handler:
-        A :class:`RequestHandler` instance.
+        A :class:`RequestHandler` class or instance.
+    :param allowed_methods:
+        The HTTP methods to check. Default is the allowed methods of the
+        active app.
     :returns:
         A list of HTTP methods supported by the handler.
     """
+    if allowed_methods is None:
+        allowed_methods = get_app().allowed_methods
+
     methods = []
-    for method in get_app().allowed_methods:
+    for method in allowed_methods:
         if getattr(handler, _normalize_handler_method(method), None):
             methods.append(method)
 
@@ -2000,32 +3125,67 @@ def _to_basestring(value):
     return value.decode("utf-8")
 
 
-def _parse_route_template(template, default_sufix=''):
-    """Lazy route template parser."""
-    variables = {}
-    reverse_template = pattern = ''
+def _split_route_template(template, default_sufix='', converters=None):
+    """Splits a route template into variables and literal parts.
+
+    :param converters:
+        A mapping of converter names to :class:`BaseConverter`. If set,
+        expressions that name a converter are replaced by its regex.
+    :returns:
+        A tuple ``(parts, tail)``, where ``parts`` is a list of tuples
+        ``(part, name, expr)`` with the literal part that precedes each
+        variable, and ``tail`` is the literal part after the last variable.
+        Unnamed variables are named ``__N__``.
+    """
+    parts = []
     args_count = last = 0
     for match in _route_re.finditer(template):
         part = template[last:match.start()]
         name = match.group(1)
         expr = match.group(2) or default_sufix
         last = match.end()
+        if converters and expr in converters:
+            expr = converters[expr].regex
 
         if not name:
             name = '__%d__' % args_count
             args_count += 1
 
+        parts.append((part, name, expr))
+
+    return parts, template[last:]
+
+
+def _parse_route_template(template, default_sufix='', converters=None):
+    """Lazy route template parser."""
+    variables = {}
+    reverse_template = pattern = ''
+    args_count = 0
+    parts, tail = _split_route_template(template, default_sufix, converters)
+    for part, name, expr in parts:
+        if name == '__%d__' % args_count:
+            args_count += 1
+
         pattern += '%s(?P<%s>%s)' % (re.escape(part), name, expr)
         reverse_template += '%s%%(%s)s' % (part, name)
         variables[name] = re.compile('^%s$' % expr)
 
-    part = template[last:]
     kwargs_count = len(variables) - args_count
-    reverse_template += part
-    regex = re.compile('^%s%s$' % (pattern, re.escape(part)))
+    reverse_template += tail
+    regex = re.compile('^%s%s$' % (pattern, re.escape(tail)))
     return regex, reverse_template, args_count, kwargs_count, variables
 
 
+def _get_template_converters(template, converters):
+    """Returns a dictionary of variable names to the converters they use."""
+    if not converters:
+        return {}
+
+    parts, tail = _split_route_template(template)
+    return dict((name, converters[expr]) for part, name, expr in parts
+                if expr in converters)
+
+
 def _get_route_variables(match, default_kwargs=None):
     """Returns (args, kwargs) for a route match."""
     kwargs = default_kwargs or {}
@@ -2040,6 +3200,1335 @@ def _get_route_variables(match, default_kwargs=None):
     return args, kwargs
 
 
+class _LRUCache(object):
+    """A thread-safe mapping that keeps a maximum number of items, evicting
+    the least recently used ones.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        """Returns the value for a key, or None if it isn't cached."""
+        with self.lock:
+            try:
+                # Re-insert it to mark it as the most recently used.
+                value = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self.data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def empty_copy(self):
+        """Returns a new empty cache with the same size and statistics."""
+        cache = _LRUCache(self.maxsize)
+        with self.lock:
+            cache.hits = self.hits
+            cache.misses = self.misses
+            cache.evictions = self.evictions
+
+        return cache
+
+    def info(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.data),
+                'maxsize': self.maxsize,
+            }
+
+
+def _get_build_key(route, name, args, kwargs):
+    """Returns a key to cache a URI built by a route, or None if it can't be
+    cached.
+
+    Only URIs that don't depend on the request and are built by
+    :meth:`Route.build` are cached. Types are part of the key because, e.g.,
+    ``1`` and ``True`` are equal but build different URIs.
+    """
+    if not isinstance(route, Route) or \
+            six.get_unbound_function(type(route).build) is not \
+            six.get_unbound_function(Route.build) or \
+            '_full' in kwargs or '_scheme' in kwargs or '_netloc' in kwargs:
+        return None
+
+    key = (
+        name,
+        tuple([(type(value), value) for value in args]),
+        tuple(sorted([(k, type(v), v) for k, v in six.iteritems(kwargs)])),
+    )
+    try:
+        hash(key)
+    except TypeError:
+        return None
+
+    return key
+
+
+def _uses_default_regex(route):
+    """Checks if a route matches the path returned by
+    :func:`_get_match_path` with the regex parsed from its template, as the
+    route indexes do.
+    """
+    return six.get_unbound_function(type(route).get_match_path) is \
+        six.get_unbound_function(BaseRoute.get_match_path) and \
+        type(route).regex is Route.regex
+
+
+def _match_any_route(routes, request):
+    """Checks if any :class:`Route` matches a request, ignoring the allowed
+    methods.
+    """
+    for route in routes:
+        if route._match_variables(request) is not None:
+            return True
+
+    return False
+
+
+def _iter_match_routes(routes):
+    """Yields match routes and, recursively, the routes nested in them."""
+    for route in routes:
+        yield route
+        children = getattr(route, 'get_match_children', None)
+        if children is not None:
+            for child in _iter_match_routes(children()):
+                yield child
+
+
+def _get_static_prefix(route):
+    """Returns the literal path prefix that a route requires, or None.
+
+    Only :class:`Route` instances that use the default matching can be
+    analysed; anything else may match any path.
+    """
+    if not isinstance(route, Route):
+        return None
+
+    return route._static_prefix
+
+
+def _split_by_method(entries, method):
+    """Splits ``(position, route)`` entries into the routes that allow an
+    HTTP method and the ones that don't.
+    """
+    allowed = []
+    excluded = []
+    for position, route in entries:
+        if _get_static_prefix(route) is not None and route.methods and \
+                method not in route.methods:
+            excluded.append(route)
+        else:
+            allowed.append(route)
+
+    return allowed, excluded
+
+
+def _are_disjoint(route, other):
+    """Checks if two match routes can never match the same request, so
+    their order doesn't matter.
+    """
+    prefix = _get_static_prefix(route)
+    other_prefix = _get_static_prefix(other)
+    if prefix is None or other_prefix is None:
+        return False
+
+    for attr in ('methods', 'schemes'):
+        values = getattr(route, attr)
+        other_values = getattr(other, attr)
+        if values and other_values and not set(values) & set(other_values):
+            return True
+
+    if not prefix.startswith(other_prefix) and \
+            not other_prefix.startswith(prefix):
+        return True
+
+    tail = route._literals[1]
+    other_tail = other._literals[1]
+    if not tail.endswith(other_tail) and not other_tail.endswith(tail):
+        return True
+
+    # A route without variables only matches its template, and a "$" also
+    # matches before a trailing newline.
+    for template, static, other in ((route.template, prefix, other),
+                                    (other.template, other_prefix, route)):
+        if template == static:
+            return (other.regex.match(template) is None and
+                    other.regex.match(template + '\n') is None)
+
+    return False
+
+
+def _get_host_key(route):
+    """Returns the key to index a route by host, or None.
+
+    Routes that only match some hosts, like
+    :class:`webapp2_extras.routes.DomainRoute`, can define a method
+    ``get_host_key()`` that returns a tuple ``(host, wildcard)``. If
+    ``wildcard`` is False, the route can only match when
+    ``environ['SERVER_NAME']`` is ``host``; otherwise ``host`` is a suffix
+    that starts with a dot, preceded by a variable that can't match a dot.
+    """
+    get_host_key = getattr(route, 'get_host_key', None)
+    if get_host_key is None:
+        return None
+
+    return get_host_key()
+
+
+class _HostRoutes(object):
+    """Consecutive match routes indexed by the host they match.
+
+    Literal hosts and wildcard suffixes are looked up in dictionaries, so
+    only the routes for the request host are tried, in declaration order.
+    """
+
+    def __init__(self):
+        self.hosts = {}
+        self.wildcards = {}
+        self.end = 0
+
+    def copy(self):
+        hosts = _HostRoutes()
+        hosts.hosts = self.hosts.copy()
+        hosts.wildcards = self.wildcards.copy()
+        hosts.end = self.end
+        return hosts
+
+    def add(self, position, route, host_key):
+        host, wildcard = host_key
+        table = self.wildcards if wildcard else self.hosts
+        # A new list, as copies share the old one.
+        table[host] = table.get(host, []) + [(position, route)]
+        self.end = position + 1
+
+    def match(self, request):
+        return self.match_route(request)[1]
+
+    def match_route(self, request):
+        """Returns ``(route, match)``, where ``route`` is the match route
+        that matched the request, or ``(None, None)``.
+        """
+        host = request.environ.get('SERVER_NAME')
+        if host is None:
+            # Let the routes deal with it.
+            entries = heapq.merge(
+                *(list(six.itervalues(self.hosts)) +
+                  list(six.itervalues(self.wildcards))))
+        else:
+            if host.endswith('\n'):
+                # A "$" in a route regex also matches before a trailing
+                # newline.
+                host = host[:-1]
+
+            entries = self.hosts.get(host, ())
+            dot = host.find('.')
+            if dot != -1:
+                wildcards = self.wildcards.get(host[dot:])
+                if wildcards:
+                    entries = heapq.merge(entries, wildcards)
+
+        method_not_allowed = False
+        for position, route in entries:
+            try:
+                match = route.match(request)
+                if match:
+                    return route, match
+            except exc.HTTPMethodNotAllowed:
+                method_not_allowed = True
+
+        if method_not_allowed:
+            raise exc.HTTPMethodNotAllowed()
+
+        return None, None
+
+
+def _can_match_path(route, path):
+    """Checks if a route may match a path, regardless of the request."""
+    if _get_static_prefix(route) is None:
+        return True
+
+    return route.regex.match(path) is not None
+
+
+class _RouteTable(object):
+    """The routes of a :class:`Router`, with their indexes and caches.
+
+    Once it is set in the router, a table is never changed, except to set
+    the lazy indexes and caches, so it can be read without locks. To add
+    routes the router makes a :meth:`copy` without the lazy state.
+    """
+
+    def __init__(self):
+        self.match_routes = []
+        #: The match routes as a tuple, built lazily.
+        self.match_tuple = None
+        self.build_routes = {}
+        self.index = _RouteIndex()
+        #: Segment index used by :meth:`Router.trie_matcher`, built lazily.
+        self.trie = None
+        #: Combined regexes used by :meth:`Router.combined_matcher`, built
+        #: lazily.
+        self.combined = None
+        #: Cache of match results, created on the first dispatch.
+        self.match_cache = None
+        #: Cache of built URIs, created on the first build.
+        self.build_cache = None
+
+    def copy(self):
+        """Returns a copy of the routes and the path index, with empty
+        caches.
+        """
+        table = _RouteTable()
+        table.match_routes = list(self.match_routes)
+        table.build_routes = self.build_routes.copy()
+        table.index = self.index.copy()
+        # Requests that use this table may still write to its caches.
+        if self.match_cache is not None:
+            table.match_cache = self.match_cache.empty_copy()
+
+        if self.build_cache is not None:
+            table.build_cache = self.build_cache.empty_copy()
+
+        return table
+
+    def replace(self, match_routes=None, build_routes=None):
+        """Returns a copy with other match or build routes, a new path
+        index and empty caches.
+        """
+        table = _RouteTable()
+        if match_routes is None:
+            match_routes = self.match_routes
+
+        table.match_routes = list(match_routes)
+        for route in table.match_routes:
+            table.index.add(route)
+
+        if build_routes is None:
+            build_routes = self.build_routes
+
+        table.build_routes = dict(build_routes)
+        if self.match_cache is not None:
+            table.match_cache = self.match_cache.empty_copy()
+
+        if self.build_cache is not None:
+            table.build_cache = self.build_cache.empty_copy()
+
+        return table
+
+    def reorder(self, match_routes, matcher=None):
+        """Returns a copy with the match routes in another order.
+
+        The new order must match the same routes for every request, so the
+        caches are kept, and so are the indexes that `matcher` doesn't use:
+        in the old order they still give the same results. Only the index
+        used by `matcher` is rebuilt, for the HTTP methods it has seen.
+        """
+        table = _RouteTable()
+        table.match_routes = list(match_routes)
+        table.build_routes = self.build_routes
+        table.index = self.index
+        table.trie = self.trie
+        table.combined = self.combined
+        if matcher is six.get_unbound_function(Router.trie_matcher):
+            table.trie = _RouteTrie(table.match_routes)
+        elif matcher is six.get_unbound_function(Router.combined_matcher):
+            if self.combined is not None:
+                table.combined = self.combined.reorder(table.match_routes)
+        else:
+            table.index = self.index.reorder(table.match_routes)
+
+        table.match_cache = self.match_cache
+        table.build_cache = self.build_cache
+        return table
+
+    def add(self, route):
+        for r in route.get_match_routes():
+            self.match_routes.append(r)
+            self.index.add(r)
+
+        for name, r in route.get_build_routes():
+            self.build_routes[name] = r
+
+
+class _RouteIndex(object):
+    """Index of match routes by exact path and HTTP method.
+
+    Routes whose template has no variables are stored in a dictionary keyed
+    by the template. A lookup for one of these paths returns them merged, in
+    declaration order, with the other routes that can also match the path;
+    any other path is only tried against routes that have variables.
+
+    Candidates are split by HTTP method: routes that define
+    :attr:`Route.methods` without the request method are left out and only
+    checked on a miss, to tell a 405 from a 404.
+
+    Consecutive routes that can be indexed by host are grouped in a
+    :class:`_HostRoutes`, which takes the place of the first of them.
+    """
+
+    def __init__(self):
+        self.routes = []
+        self.static = {}
+        self.dynamic = []
+        self.methods = {}
+        self.candidates = {}
+
+    def copy(self):
+        """Returns a copy that can be changed without changing this one."""
+        index = _RouteIndex()
+        index.routes = list(self.routes)
+        index.static = self.static.copy()
+        index.dynamic = list(self.dynamic)
+        if index.dynamic and isinstance(index.dynamic[-1][1], _HostRoutes):
+            # Only the last group of host routes can grow.
+            position, hosts = index.dynamic[-1]
+            index.dynamic[-1] = (position, hosts.copy())
+
+        return index
+
+    def add(self, route):
+        position = len(self.routes)
+        entry = (position, route)
+        self.routes.append(route)
+        prefix = _get_static_prefix(route)
+        host_key = _get_host_key(route)
+        if host_key is not None:
+            hosts = self.dynamic[-1][1] if self.dynamic else None
+            if not isinstance(hosts, _HostRoutes) or hosts.end != position:
+                hosts = _HostRoutes()
+                self.dynamic.append((position, hosts))
+
+            hosts.add(position, route, host_key)
+        elif prefix is not None and prefix == route.template:
+            # A new list, as copies of the index share the old one.
+            self.static[prefix] = self.static.get(prefix, []) + [entry]
+        else:
+            self.dynamic.append(entry)
+
+        # Cached candidates may miss the new route.
+        self.methods = {}
+        self.candidates = {}
+
+    def reorder(self, routes):
+        """Returns an index of the same routes in another order, split for
+        the same methods.
+        """
+        index = _RouteIndex()
+        for route in routes:
+            index.add(route)
+
+        index.prepare(list(self.methods))
+        return index
+
+    def prepare(self, methods):
+        """Splits the routes with variables for the given methods."""
+        for method in methods:
+            if method not in self.methods:
+                self.methods[method] = _split_by_method(self.dynamic, method)
+
+    def lookup(self, path, method):
+        """Returns the routes that may match a path and method.
+
+        :returns:
+            A tuple ``(routes, excluded)`` with the routes to try in
+            declaration order and the routes that could only match with
+            another method.
+        """
+        key = (path, method)
+        rv = self.candidates.get(key)
+        if rv is not None:
+            return rv
+
+        if path.endswith('\n'):
+            # A "$" in a route regex also matches before a trailing newline.
+            return self.routes, ()
+
+        entries = self.static.get(path)
+        if entries is None:
+            rv = self.methods.get(method)
+            if rv is None:
+                self.methods[method] = rv = _split_by_method(self.dynamic,
+                                                             method)
+            return rv
+
+        dynamic = [(position, route) for position, route in self.dynamic
+                   if _can_match_path(route, path)]
+        self.candidates[key] = rv = _split_by_method(
+            heapq.merge(entries, dynamic), method)
+        return rv
+
+
+def _get_route_alternative(route):
+    """Returns how to combine a route regex with others in an alternation.
+
+    :returns:
+        A tuple ``(pattern, groups, args, kwargs)`` with the regex pattern
+        without anchors, its number of groups and the group offsets of
+        positional and keyword variables, or None if the route must be
+        matched on its own.
+    """
+    if _get_static_prefix(route) is None:
+        return None
+
+    route.regex
+    if route._converters:
+        # Values must be converted by the route.
+        return None
+
+    parts, tail = _split_route_template(route.template,
+                                        default_sufix='[^/]+')
+    pattern = ''
+    groups = 0
+    args = []
+    kwargs = []
+    for part, name, expr in parts:
+        if _backreference_re.search(expr):
+            return None
+
+        try:
+            compiled = re.compile(expr)
+        except re.error:
+            return None
+
+        if compiled.groupindex:
+            # Named groups would be added to the route keywords.
+            return None
+
+        groups += 1
+        if name.startswith('__') and name.endswith('__'):
+            args.append(groups)
+        else:
+            kwargs.append((name, groups))
+
+        groups += compiled.groups
+        pattern += '%s(%s)' % (re.escape(part), expr)
+
+    return pattern + re.escape(tail), groups, args, kwargs
+
+
+class _CombinedRoutes(object):
+    """Match routes compiled into one alternation per HTTP method.
+
+    Each bucket is a list of items ``(regex, entries, routes)``: ``regex``
+    combines a run of consecutive routes and ``entries`` maps the group
+    index of each alternative to ``(position, route, args, kwargs)``. For
+    routes that can't be combined ``regex`` is None and ``routes`` holds
+    the single route.
+
+    Runs are split before the routes whose template hashes to a multiple of
+    :attr:`run_size`, so moving a few routes only changes the runs around
+    them, and :meth:`reorder` compiles those again.
+    """
+
+    #: Maximum number of groups in a combined regex.
+    max_groups = 100 if six.PY2 else 10000
+    #: Average number of routes in a combined regex.
+    run_size = 32
+
+    def __init__(self, routes, alternatives=None):
+        self.routes = list(routes)
+        if alternatives is None:
+            alternatives = [_get_route_alternative(r) for r in self.routes]
+
+        self.alternatives = alternatives
+        self.buckets = {}
+        #: Compiled items, keyed by the routes of their run.
+        self.runs = {}
+
+    def reorder(self, routes):
+        """Returns a copy with the routes in another order, compiled for the
+        same methods. Runs that didn't change are reused.
+        """
+        alternatives = dict(zip(self.routes, self.alternatives))
+        combined = _CombinedRoutes(routes, [alternatives[r] for r in routes])
+        combined.runs = self.runs
+        combined.prepare(list(self.buckets))
+        # Drop the runs that are gone.
+        combined.runs = dict((tuple(item[2]), item)
+                             for items, excluded in
+                             six.itervalues(combined.buckets)
+                             for item in items if item[0] is not None)
+        return combined
+
+    def prepare(self, methods):
+        """Compiles the regexes for the given methods."""
+        for method in methods:
+            if method not in self.buckets:
+                self.buckets[method] = self._compile(method)
+
+    def match(self, request):
+        """Returns ``(route, match)``, where ``route`` is the match route
+        that matched the request.
+        """
+        method = request.method
+        bucket = self.buckets.get(method)
+        if bucket is None:
+            self.buckets[method] = bucket = self._compile(method)
+
+        items, excluded = bucket
+        path = _get_match_path(request)
+        method_not_allowed = False
+        for regex, entries, routes in items:
+            if regex is None:
+                try:
+                    match = routes[0].match(request)
+                    if match:
+                        return routes[0], match
+                except exc.HTTPMethodNotAllowed:
+                    method_not_allowed = True
+
+                continue
+
+            match = regex.match(path)
+            if match is None:
+                continue
+
+            position, route, args, kwargs = entries[match.lastindex]
+            if route.schemes and request.scheme not in route.schemes:
+                # Rare: try the remaining routes of this run one by one.
+                for route in routes[position + 1:]:
+                    match = route.match(request)
+                    if match:
+                        return route, match
+
+                continue
+
+            values = route.defaults.copy()
+            for name, index in kwargs:
+                values[name] = match.group(index)
+
+            return route, (route, tuple(match.group(i) for i in args),
+                           values)
+
+        if method_not_allowed or _match_any_route(excluded, request):
+            raise exc.HTTPMethodNotAllowed()
+
+        raise exc.HTTPNotFound()
+
+    def _compile(self, method):
+        """Returns ``(items, excluded)`` for a method, where ``excluded``
+        holds the routes that don't allow it.
+        """
+        items = []
+        excluded = []
+        run = []
+        for route, alternative in zip(self.routes, self.alternatives):
+            if alternative is None:
+                self._add_run(items, run)
+                run = []
+                items.append((None, None, [route]))
+            elif route.methods and method not in route.methods:
+                excluded.append(route)
+            else:
+                if run and not hash(route.template) % self.run_size:
+                    self._add_run(items, run)
+                    run = []
+
+                run.append((route, alternative))
+
+        self._add_run(items, run)
+        return items, excluded
+
+    def _add_run(self, items, run):
+        patterns = []
+        entries = {}
+        routes = []
+        offset = 1
+        for route, (pattern, groups, args, kwargs) in run:
+            if patterns and offset + groups >= self.max_groups:
+                items.append(self._combine(patterns, entries, routes))
+                patterns = []
+                entries = {}
+                routes = []
+                offset = 1
+
+            entries[offset] = (
+                len(routes), route, [offset + i for i in args],
+                [(name, offset + i) for name, i in kwargs])
+            patterns.append('(%s)$' % pattern)
+            routes.append(route)
+            offset += groups + 1
+
+        if patterns:
+            items.append(self._combine(patterns, entries, routes))
+
+    def _combine(self, patterns, entries, routes):
+        key = tuple(routes)
+        item = self.runs.get(key)
+        if item is None:
+            self.runs[key] = item = (re.compile('|'.join(patterns)), entries,
+                                     routes)
+
+        return item
+
+
+class _RouteTrie(object):
+    """Index of match routes by the literal path segments of their templates.
+
+    Each node is a tuple ``(children, entries)``, where ``children`` maps a
+    path segment to a child node and ``entries`` is a list of
+    ``(position, route)`` for routes whose static prefix ends at that node.
+    """
+
+    def __init__(self, routes):
+        self.root = ({}, [])
+        for position, route in enumerate(routes):
+            self.add(position, route)
+
+    def add(self, position, route):
+        node = self.root
+        # Routes that don't match their template as usual, e.g. with a
+        # custom regex, have no prefix and stay at the root.
+        prefix = _get_static_prefix(route)
+        if prefix and prefix.startswith('/'):
+            # Only segments followed by a slash are complete: the last one
+            # may continue with a variable.
+            for segment in prefix.split('/')[1:-1]:
+                node = node[0].setdefault(segment, ({}, []))
+
+        node[1].append((position, route))
+
+    def lookup(self, path):
+        """Returns the routes that may match a path, in declaration order."""
+        node = self.root
+        found = [node[1]] if node[1] else []
+        for segment in path.split('/')[1:-1]:
+            node = node[0].get(segment)
+            if node is None:
+                break
+
+            if node[1]:
+                found.append(node[1])
+
+        if len(found) == 1:
+            return [route for position, route in found[0]]
+
+        return [route for position, route in heapq.merge(*found)]
+
+
+def _get_route_builder(route):
+    """Returns a function that builds the URI path of a :class:`Route`.
+
+    The function receives ``(args, kwargs, trusted)`` and returns a tuple
+    ``(path, kwargs)`` with the keywords that were not used. Literal parts
+    and variables are sorted out once; if `trusted` is True values are not
+    validated against the variable regexes. Variables with a converter are
+    converted back first, and the result is validated.
+    """
+    parts, tail = _split_route_template(route.template)
+    if not parts:
+        def build(args, kwargs, trusted=False):
+            return tail, kwargs
+
+        return build
+
+    pieces = [(part, name) for part, name, expr in parts]
+    converters = route._converters or {}
+    variables = [(name, regex, converters.get(name))
+                 for name, regex in six.iteritems(route.variables)]
+    positional = ['__%d__' % i for i in range(route.args_count)]
+
+    def build(args, kwargs, trusted=False):
+        if args and positional:
+            for name, value in zip(positional, args):
+                kwargs[name] = value
+
+        defaults = route.defaults
+        values = {}
+        for name, regex, converter in variables:
+            value = kwargs.pop(name, defaults.get(name))
+            if value is None:
+                raise KeyError('Missing argument "%s" to build URI.' %
+                               name.strip('_'))
+
+            if converter is not None:
+                try:
+                    value = converter.to_url(value)
+                except (TypeError, ValueError):
+                    raise ValueError(
+                        'URI building error: Value "%s" is not supported'
+                        'for argument "%s".' % (value, name.strip('_'))
+                    )
+            elif not isinstance(value, six.string_types):
+                value = str(value)
+
+            if not trusted and not regex.match(value):
+                raise ValueError(
+                    'URI building error: Value "%s" is not supported'
+                    'for argument "%s".' % (value, name.strip('_'))
+                )
+
+            values[name] = value
+
+        path = ''.join([part + values[name] for part, name in pieces])
+        return path + tail, kwargs
+
+    return build
+
+
+def _get_route_extractor(regex, converters=None):
+    """Returns a function that extracts ``(args, kwargs)`` from a route match.
+
+    The result is the same as :func:`_get_route_variables`, but the groups
+    for positional and keyword variables are sorted out once, when the
+    route regex is compiled. The function receives the match and the route
+    default values, which are copied.
+
+    :param converters:
+        A dictionary of variable names to :class:`BaseConverter`, applied to
+        the values. The function raises ``ValueError`` if a value is not
+        valid.
+    """
+    if converters:
+        return _get_converting_extractor(_get_route_extractor(regex),
+                                         converters)
+
+    positional = []
+    named = []
+    for name, index in six.iteritems(regex.groupindex):
+        if name.startswith('__') and name.endswith('__'):
+            positional.append((int(name[2:-2]), index))
+        else:
+            named.append((name, index))
+
+    args = tuple(index for position, index in sorted(positional))
+    named = tuple(sorted(named, key=lambda item: item[1]))
+
+    if not args:
+        if not named:
+            def extract(match, defaults):
+                return (), defaults.copy()
+        else:
+            def extract(match, defaults):
+                kwargs = defaults.copy()
+                kwargs.update(match.groupdict())
+                return (), kwargs
+    elif not named:
+        if args == tuple(range(1, regex.groups + 1)):
+            def extract(match, defaults):
+                return match.groups(), defaults.copy()
+        elif len(args) == 1:
+            index = args[0]
+
+            def extract(match, defaults):
+                return (match.group(index),), defaults.copy()
+        else:
+            def extract(match, defaults):
+                return match.group(*args), defaults.copy()
+    else:
+        def extract(match, defaults):
+            kwargs = defaults.copy()
+            for name, index in named:
+                kwargs[name] = match.group(index)
+
+            return tuple([match.group(index) for index in args]), kwargs
+
+    return extract
+
+
+def _get_converting_extractor(extract, converters):
+    """Wraps a route extractor to apply converters to the values."""
+    positional = []
+    named = []
+    for name, converter in sorted(six.iteritems(converters)):
+        if name.startswith('__') and name.endswith('__'):
+            positional.append((int(name[2:-2]), converter.to_python))
+        else:
+            named.append((name, converter.to_python))
+
+    def convert(match, defaults):
+        args, kwargs = extract(match, defaults)
+        if positional:
+            args = list(args)
+            for position, to_python in positional:
+                args[position] = to_python(args[position])
+
+            args = tuple(args)
+
+        for name, to_python in named:
+            kwargs[name] = to_python(kwargs[name])
+
+        return args, kwargs
+
+    return convert
+
+
+def _set_request_limits(request, route):
+    """Sets the limits of the app and route on a request, and checks the
+    body size.
+
+    If the body size is unknown, the body stream is replaced by one that
+    raises an error when the limit is exceeded.
+    """
+    app_limits = getattr(request.app, 'limits', None)
+    route_limits = getattr(route, 'limits', None)
+    if not app_limits and not route_limits:
+        return
+
+    limits = dict(app_limits or {}, **(route_limits or {}))
+    for name in ('max_body_size', 'max_form_fields', 'max_form_bytes',
+                 'max_json_size', 'max_decoded_size'):
+        if name in limits:
+            setattr(request, name, limits[name])
+
+    max_size = request.max_body_size
+    if max_size is None:
+        return
+
+    length = request.content_length
+    if length is not None:
+        if length > max_size:
+            abort(413, 'The request body is too large.')
+    elif request.is_body_readable and not request.is_body_seekable:
+        environ = request.environ
+        environ['wsgi.input'] = _LimitedStream(environ['wsgi.input'],
+                                               max_size)
+
+
+def _set_content_decoding(request):
+    """Replaces a gzip or deflate request body by a stream that decompresses
+    it, so the body, forms and JSON are read decompressed.
+
+    The ``Content-Encoding`` and ``Content-Length`` headers are removed, as
+    they don't apply to the new body. The decompressed size is limited by
+    ``max_decoded_size`` or, if it is not set, by ``max_body_size``.
+    """
+    environ = request.environ
+    encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        wbits = 16 + zlib.MAX_WBITS
+    elif encoding == 'deflate':
+        wbits = None
+    else:
+        return
+
+    stream = request.body_file
+    if request.is_body_seekable:
+        stream.seek(0)
+
+    limit = request.max_decoded_size
+    if limit is None:
+        limit = request.max_body_size
+
+    environ['wsgi.input'] = _DecodingStream(stream, wbits, limit,
+                                            request.body_chunk_size)
+    environ['wsgi.input_terminated'] = True
+    environ['webob.is_body_seekable'] = False
+    environ.pop('CONTENT_LENGTH', None)
+    del environ['HTTP_CONTENT_ENCODING']
+
+
+def _check_form_body(request):
+    """Raises a 413 error if the form body of a request exceeds its form
+    limits, before WebOb parses it.
+
+    URL-encoded bodies are checked by size, while they are read if the
+    size is unknown, and their fields are counted without being decoded.
+    Multipart bodies are scanned with :class:`_MultipartParser`, which
+    skips the data of uploaded files.
+    """
+    content_type = request.content_type
+    if content_type not in ('', 'application/x-www-form-urlencoded',
+                            'multipart/form-data') or \
+            not content_type and request.method != 'POST':
+        # Not a form: WebOb doesn't parse it.
+        return
+
+    environ = request.environ
+    max_fields = request.max_form_fields
+    max_bytes = request.max_form_bytes
+    if content_type == 'multipart/form-data':
+        request.make_body_seekable()
+        boundary = cgi.parse_header(environ['CONTENT_TYPE'])[1].get(
+            'boundary')
+        if boundary:
+            stream = request.body_file_raw
+            stream.seek(0)
+            parser = _MultipartParser(stream, boundary.encode('latin-1'),
+                                      request.body_chunk_size, max_fields,
+                                      max_bytes)
+            for part in parser:
+                pass
+
+            stream.seek(0)
+
+        return
+
+    if max_bytes is not None:
+        length = request.content_length
+        if length is not None:
+            if length > max_bytes:
+                abort(413, 'The form fields are too large.')
+        elif request.is_body_readable and not request.is_body_seekable:
+            environ['wsgi.input'] = _LimitedStream(environ['wsgi.input'],
+                                                   max_bytes)
+
+    request.make_body_seekable()
+    if max_fields is not None:
+        count = sum(1 for field in request.body.split(b'&') if field)
+        if count > max_fields:
+            abort(413, 'Too many form fields.')
+
+
+class _PostVars(MultiDict):
+    """A ``MultiDict`` of POST variables that counts its changes, so values
+    derived from it can be cached until it changes.
+    """
+
+    #: Number of changes made.
+    version = 0
+
+    def __setitem__(self, key, value):
+        self.version += 1
+        super(_PostVars, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.version += 1
+        super(_PostVars, self).__delitem__(key)
+
+    def add(self, key, value):
+        self.version += 1
+        super(_PostVars, self).add(key, value)
+
+    def clear(self):
+        self.version += 1
+        super(_PostVars, self).clear()
+
+    def extend(self, *args, **kwargs):
+        self.version += 1
+        super(_PostVars, self).extend(*args, **kwargs)
+
+    def pop(self, *args):
+        self.version += 1
+        return super(_PostVars, self).pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super(_PostVars, self).popitem()
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return super(_PostVars, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self.version += 1
+        super(_PostVars, self).update(*args, **kwargs)
+
+
+class _LimitedStream(object):
+    """A stream that raises a 413 error if more than `limit` bytes are
+    read from it.
+    """
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.remaining = limit
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            # Read one byte past the limit, to detect larger bodies.
+            data = self.stream.read(self.remaining + 1)
+        else:
+            data = self.stream.read(size)
+
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            abort(413, 'The request body is too large.')
+
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining + 1:
+            size = self.remaining + 1
+
+        data = self.stream.readline(size)
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            abort(413, 'The request body is too large.')
+
+        return data
+
+
+class _DecodingStream(object):
+    """A stream that decompresses gzip or deflate data from another one.
+
+    Data is decompressed in chunks, so the memory used doesn't depend on
+    the compression ratio. A 413 error is raised if more than `limit`
+    bytes are decompressed, and a 400 error if the data is invalid.
+    """
+
+    def __init__(self, stream, wbits, limit=None, chunk_size=64 * 1024):
+        """Initializes the stream.
+
+        :param wbits:
+            The ``wbits`` argument for ``zlib.decompressobj()``, or None for
+            deflate data with or without the zlib header.
+        """
+        self.stream = stream
+        self.wbits = wbits
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.decompressor = None
+        self.buffer = b''
+        self.size = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self.buffer]
+            self.buffer = b''
+            while not self.eof:
+                chunks.append(self._decompress())
+
+            return b''.join(chunks)
+
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while length < size and not self.eof:
+            chunks.append(self._decompress())
+            length += len(chunks[-1])
+
+        buffer = b''.join(chunks)
+        self.buffer = buffer[size:]
+        return buffer[:size]
+
+    def readline(self, size=-1):
+        while b'\n' not in self.buffer and not self.eof and \
+                (size is None or size < 0 or len(self.buffer) < size):
+            self.buffer += self._decompress()
+
+        index = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size is not None and 0 <= size < index:
+            index = size
+
+        data = self.buffer[:index]
+        self.buffer = self.buffer[index:]
+        return data
+
+    def _decompress(self):
+        """Returns up to :attr:`chunk_size` decompressed bytes."""
+        decompressor = self.decompressor
+        try:
+            if decompressor is not None and decompressor.unconsumed_tail:
+                data = decompressor.decompress(decompressor.unconsumed_tail,
+                                               self.chunk_size)
+            else:
+                raw = self.stream.read(self.chunk_size)
+                if decompressor is None:
+                    if not raw:
+                        # An empty body.
+                        self.eof = True
+                        return b''
+
+                    decompressor = self._get_decompressor(raw)
+
+                if raw:
+                    data = decompressor.decompress(raw, self.chunk_size)
+                else:
+                    self.eof = True
+                    data = decompressor.flush()
+                    if getattr(decompressor, 'eof', True) is False:
+                        raise zlib.error('Incomplete data.')
+        except zlib.error:
+            abort(400, 'The request body could not be decompressed.')
+
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            abort(413, 'The decompressed request body is too large.')
+
+        return data
+
+    def _get_decompressor(self, data):
+        wbits = self.wbits
+        if wbits is None:
+            # Deflate data is often sent without the zlib header.
+            if len(data) >= 2 and ord(data[0:1]) & 0x0f == 8 and \
+                    (ord(data[0:1]) * 256 + ord(data[1:2])) % 31 == 0:
+                wbits = zlib.MAX_WBITS
+            else:
+                wbits = -zlib.MAX_WBITS
+
+        self.decompressor = zlib.decompressobj(wbits)
+        return self.decompressor
+
+
+class _MultipartParser(object):
+    """Parses a ``multipart/form-data`` body from a stream, in chunks.
+
+    Iterating the parser returns :class:`FormPart` instances that read
+    their data from the stream; the data left unread by a part is skipped
+    when the next one is requested. ``exc.HTTPBadRequest`` is raised if the
+    body is malformed, also while a part is read.
+    """
+
+    #: Maximum size of the headers of a part.
+    max_header_size = 16 * 1024
+
+    def __init__(self, stream, boundary, chunk_size, max_fields=None,
+                 max_field_bytes=None):
+        self.stream = stream
+        self.delimiter = b'\r\n--' + boundary
+        self.chunk_size = chunk_size
+        self.max_fields = max_fields
+        self.max_field_bytes = max_field_bytes
+        self.field_bytes = 0
+        # The first delimiter is not preceded by a line break.
+        self.buffer = b'\r\n'
+        self.part = None
+
+    def __iter__(self):
+        # The preamble is read as the data of an unnamed part.
+        self.part = part = _MultipartStream(self)
+        while part.read(self.chunk_size):
+            pass
+
+        count = 0
+        while True:
+            line = self._read_line()
+            if line.startswith(b'--'):
+                # The close delimiter.
+                return
+
+            if line.strip():
+                abort(400, 'Invalid multipart boundary.')
+
+            count += 1
+            if self.max_fields is not None and count > self.max_fields:
+                abort(413, 'Too many form fields.')
+
+            self.part = part = _MultipartStream(self)
+            form_part = FormPart(self._read_headers(), part,
+                                 self.chunk_size)
+            if form_part.filename is None and \
+                    self.max_field_bytes is not None:
+                part.counted = True
+                self._count_field_bytes(
+                    len((form_part.name or '').encode('utf-8')))
+
+            yield form_part
+            while part.read(self.chunk_size):
+                pass
+
+    def _count_field_bytes(self, size):
+        self.field_bytes += size
+        if self.field_bytes > self.max_field_bytes:
+            abort(413, 'The form fields are too large.')
+
+    def _fill(self):
+        """Reads a chunk into the buffer. Returns False at the end of the
+        stream.
+        """
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            return False
+
+        self.buffer += chunk
+        return True
+
+    def _read_line(self):
+        while True:
+            index = self.buffer.find(b'\r\n')
+            if index != -1:
+                line = self.buffer[:index]
+                self.buffer = self.buffer[index + 2:]
+                return line
+
+            if len(self.buffer) > self.max_header_size:
+                abort(400, 'Multipart headers are too large.')
+
+            if not self._fill():
+                abort(400, 'Unexpected end of multipart body.')
+
+    def _read_headers(self):
+        headers = {}
+        size = 0
+        while True:
+            line = self._read_line()
+            if not line:
+                return headers
+
+            size += len(line)
+            if size > self.max_header_size:
+                abort(400, 'Multipart headers are too large.')
+
+            name, sep, value = line.decode('utf-8', 'replace').partition(':')
+            if not sep:
+                abort(400, 'Invalid multipart header.')
+
+            headers[name.strip().lower()] = value.strip()
+
+    def read(self, part, size):
+        """Returns up to `size` bytes of data of a part, or all the data
+        up to the next delimiter if `size` is negative. Returns an empty
+        string at the end of the part.
+        """
+        if part is not self.part:
+            return b''
+
+        delimiter = self.delimiter
+        while True:
+            buffer = self.buffer
+            index = buffer.find(delimiter)
+            if index == -1:
+                # The end of the buffer may be the start of a delimiter.
+                available = len(buffer) - len(delimiter) + 1
+            else:
+                available = index
+
+            if available > 0:
+                if 0 <= size < available:
+                    available = size
+
+                if part.counted:
+                    self._count_field_bytes(available)
+
+                self.buffer = buffer[available:]
+                return buffer[:available]
+
+            if index == 0:
+                self.buffer = buffer[len(delimiter):]
+                self.part = None
+                return b''
+
+            if not self._fill():
+                abort(400, 'Unexpected end of multipart body.')
+
+
+class _MultipartStream(object):
+    """A file-like object that reads the data of a multipart part."""
+
+    #: True if the data counts for the form field bytes limit.
+    counted = False
+
+    def __init__(self, parser):
+        self.parser = parser
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.parser.read(self, -1), b''))
+        elif size == 0:
+            return b''
+
+        return self.parser.read(self, size)
+
+
 def _set_thread_safe_app():
     """Assigns WSGIApplication globals to a proxy pointing to thread-local."""
     if _local is not None:  # pragma: no cover
@@ -59,7 +59,7 @@ def decode(value, *args, **kwargs):
     This comes from `Tornado`_.
 
     :param value:
-        A value to be deserialized.
+        A value to be deserialized. Bytes are decoded as UTF-8.
     :param args:
         Extra arguments to be passed to `json.loads()`.
     :param kwargs:
@@ -19,8 +19,9 @@ webapp2_extras.routes
 
 Extra route classes for webapp2.
 """
+import re
+
 import six
-from six.moves.urllib import parse
 
 import webapp2
 from webob import exc
@@ -107,6 +108,34 @@ class DomainRoute(MultiRoute):
         # This route will do pre-matching before matching the nested routes!
         yield self
 
+    def get_host_key(self):
+        """Returns the key used by :class:`webapp2.Router` to index this
+        route by host.
+
+        :returns:
+            ``(host, False)`` if the template is a literal host,
+            ``(suffix, True)`` if it is a variable that can't match a dot
+            followed by a literal suffix, like ``<subdomain>.example.com``,
+            or None if the route must always be tried, as when a subclass
+            overrides :attr:`regex` or :meth:`match`.
+        """
+        cls = type(self)
+        if cls.regex is not DomainRoute.regex or \
+                six.get_unbound_function(cls.match) is not \
+                six.get_unbound_function(DomainRoute.match):
+            return None
+
+        parts, tail = webapp2._split_route_template(self.template,
+                                                    default_sufix=r'[^\.]+')
+        if not parts:
+            return tail, False
+
+        if len(parts) == 1 and not parts[0][0] and tail.startswith('.') and \
+                _dotless_re.match(parts[0][2]):
+            return tail, True
+
+        return None
+
     def match(self, request):
         # Use SERVER_NAME to ignore port number that comes with request.host?
         # host_match = self.regex.match(request.host.split(':', 1)[0])
@@ -121,7 +150,7 @@ class DomainRoute(MultiRoute):
     def regex(self):
         regex, reverse_template, args_count, kwargs_count, variables = \
             webapp2._parse_route_template(self.template,
-                                          default_sufix='[^\.]+')
+                                          default_sufix=r'[^\.]+')
         return regex
 
 
@@ -198,11 +227,18 @@ class PathPrefixRoute(NamePrefixRoute):
         ])
 
     This is not only convenient, but also performs better: the nested routes
-    will only be tested if the path prefix matches.
+    will only be tested if the path prefix matches, and they are matched
+    against the rest of the path, after the prefix. Nested path prefixes
+    work the same way, so each level only matches its own part of the path.
     """
 
     _attr = 'template'
 
+    #: The path is matched as with :class:`webapp2.BaseRoute`. Override it
+    #: to match another path.
+    get_match_path = six.get_unbound_function(
+        webapp2.BaseRoute.get_match_path)
+
     def __init__(self, prefix, routes):
         """Initializes a URL route.
 
@@ -214,24 +250,146 @@ class PathPrefixRoute(NamePrefixRoute):
         """
         assert prefix.startswith('/') and not prefix.endswith('/'), \
             'Path prefixes must start with a slash but not end with a slash.'
+        # Keep the templates relative to this prefix, before they are set.
+        children = []
+        for route in routes:
+            if isinstance(route, PathPrefixRoute):
+                children.append(route)
+            else:
+                for r in route.get_routes():
+                    children.append(_PrefixChild(r, r.template))
+
         super(PathPrefixRoute, self).__init__(prefix, routes)
+        self.prefix_children = children
 
     def get_match_routes(self):
         # This route will do pre-matching before matching the nested routes!
         yield self
 
     def match(self, request):
-        if not self.regex.match(parse.unquote(request.path)):
+        return self._match_suffix(request, self.get_match_path(request),
+                                  (), {})
+
+    def _match_suffix(self, request, path, args, kwargs):
+        """Matches the nested routes against the path after this prefix.
+
+        :param path:
+            The part of the request path not matched by outer prefixes.
+        :param args:
+            Positional variables captured by outer prefixes.
+        :param kwargs:
+            Keyword variables captured by outer prefixes.
+        """
+        match = self.regex.match(path)
+        if not match:
             return None
 
-        return _match_routes(self.get_match_children, request)
+        if not self.splits_path:
+            # Only full paths can tell where a variable of the prefix ends.
+            return _match_routes(self.get_match_children, request)
+
+        prefix_args, prefix_kwargs = webapp2._get_route_variables(match)
+        # The last positional variable is the rest of the path.
+        path = prefix_args[-1]
+        args += prefix_args[:-1]
+        if prefix_kwargs:
+            kwargs = dict(kwargs, **prefix_kwargs)
+
+        method_not_allowed = False
+        for child in self.prefix_children:
+            try:
+                match = child._match_suffix(request, path, args, kwargs)
+                if match:
+                    return match
+            except exc.HTTPMethodNotAllowed:
+                method_not_allowed = True
+
+        if method_not_allowed:
+            raise exc.HTTPMethodNotAllowed()
 
     @webapp2.cached_property
     def regex(self):
+        # The rest of the path may end with a newline, which "$" matches
+        # before in the full template.
         regex, reverse_template, args_count, kwargs_count, variables = \
-            webapp2._parse_route_template(self.prefix + '<:/.*>')
+            webapp2._parse_route_template(
+                self.prefix + r'<:/[\s\S]*>',
+                converters=webapp2.Route.converters)
         return regex
 
+    @webapp2.cached_property
+    def splits_path(self):
+        """True if the prefix can only match up to a fixed number of slashes,
+        so nested routes can be matched against the rest of the path.
+
+        Prefixes with converters are not split, so the nested routes convert
+        the values.
+        """
+        parts, tail = webapp2._split_route_template(self.prefix)
+        return all(_slashless_re.match(expr) and
+                   expr not in webapp2.Route.converters
+                   for part, name, expr in parts)
+
+
+class _PrefixChild(object):
+    """A route nested in a :class:`PathPrefixRoute`, with its template
+    relative to the prefix.
+    """
+
+    def __init__(self, route, template):
+        self.route = route
+        self.template = template
+
+    @webapp2.cached_property
+    def matches_suffix(self):
+        """True if the route can be matched against the path suffix only."""
+        route = self.route
+        return (self.template.startswith('/') and
+                webapp2._get_static_prefix(route) is not None and
+                six.get_unbound_function(type(route).get_match_routes) is
+                six.get_unbound_function(webapp2.BaseRoute.get_match_routes))
+
+    @webapp2.cached_property
+    def regex(self):
+        regex, reverse_template, args_count, kwargs_count, variables = \
+            webapp2._parse_route_template(self.template,
+                                          default_sufix='[^/]+',
+                                          converters=self.route.converters)
+        return regex
+
+    @webapp2.cached_property
+    def extractor(self):
+        converters = webapp2._get_template_converters(self.template,
+                                                      self.route.converters)
+        return webapp2._get_route_extractor(self.regex, converters)
+
+    @webapp2.cached_property
+    def match_routes(self):
+        return list(self.route.get_match_routes())
+
+    def _match_suffix(self, request, path, args, kwargs):
+        route = self.route
+        if not self.matches_suffix:
+            return _match_routes(self.match_routes.__iter__, request)
+
+        if route.build_only:
+            return None
+
+        match = self.regex.match(path)
+        if not match or route.schemes and request.scheme not in route.schemes:
+            return None
+
+        try:
+            route_args, route_kwargs = self.extractor(match, route.defaults)
+        except ValueError:
+            return None
+
+        if route.methods and request.method not in route.methods:
+            raise exc.HTTPMethodNotAllowed()
+
+        route_kwargs.update(kwargs)
+        return route, args + tuple(route_args), route_kwargs
+
 
 class RedirectRoute(webapp2.Route):
     """A convenience route class for easy redirects.
@@ -243,7 +401,7 @@ class RedirectRoute(webapp2.Route):
     def __init__(self, template, handler=None, name=None, defaults=None,
                  build_only=False, handler_method=None, methods=None,
                  schemes=None, redirect_to=None, redirect_to_name=None,
-                 strict_slash=False):
+                 strict_slash=False, limits=None):
         """Initializes a URL route. Extra arguments compared to
         :meth:`webapp2.Route.__init__`:
 
@@ -284,7 +442,7 @@ class RedirectRoute(webapp2.Route):
         super(RedirectRoute, self).__init__(
             template, handler=handler, name=name, defaults=defaults,
             build_only=build_only, handler_method=handler_method,
-            methods=methods, schemes=schemes)
+            methods=methods, schemes=schemes, limits=limits)
 
         if strict_slash and not name:
             raise ValueError('Routes with strict_slash must have a name.')
@@ -309,17 +467,98 @@ class RedirectRoute(webapp2.Route):
             main_route = self
 
         if not self.build_only:
-            if self.strict_slash is True:
-                if self.template.endswith('/'):
-                    template = self.template[:-1]
-                else:
-                    template = self.template + '/'
-
+            if self.strict_slash is True and (main_route is not self or
+                                              self._strict is None):
                 yield main_route
-                yield self._get_redirect_route(template=template)
+                yield self._slash_route
             else:
                 yield main_route
 
+    def match(self, request):
+        """Matches this route against the current request.
+
+        With **strict_slash**, the path is matched with or without the
+        trailing slash in one go. If the slash doesn't match the template,
+        a route that redirects to the strict path is returned.
+
+        .. seealso:: :meth:`webapp2.Route.match`.
+        """
+        strict = self._strict
+        if strict is None:
+            return super(RedirectRoute, self).match(request)
+
+        regex, extractor = strict
+        match = regex.match(self.get_match_path(request))
+        if not match:
+            return None
+
+        if (match.group(regex.groups) is None) == \
+                self.template.endswith('/'):
+            # The redirect ignores methods and schemes.
+            route = self._slash_route
+        elif self.schemes and request.scheme not in self.schemes:
+            return None
+        else:
+            route = self
+
+        try:
+            args, kwargs = extractor(match, route.defaults)
+        except ValueError:
+            return None
+
+        if route is self and self.methods and \
+                request.method not in self.methods:
+            raise exc.HTTPMethodNotAllowed()
+
+        return route, args, kwargs
+
+    @property
+    def _matches_template(self):
+        """Without the strict matching, :meth:`match` is the default one."""
+        return self._strict is None and webapp2._uses_default_regex(self)
+
+    @property
+    def _slash_template(self):
+        """The template with a different trailing slash."""
+        if self.template.endswith('/'):
+            return self.template[:-1]
+
+        return self.template + '/'
+
+    @webapp2.cached_property
+    def _slash_route(self):
+        return self._get_redirect_route(template=self._slash_template)
+
+    @webapp2.cached_property
+    def _strict(self):
+        """Returns ``(regex, extractor)`` to match the template with an
+        optional trailing slash, or None if this route matches as usual.
+
+        Templates without variables keep a separate redirect route, because
+        both are indexed by path. The same applies if the last variable
+        could match the slash.
+        """
+        if self.strict_slash is not True or self.redirect_to_name:
+            return None
+
+        template = self.template
+        if template.endswith('/'):
+            template = template[:-1]
+
+        converters = self.converters
+        parts, tail = webapp2._split_route_template(template,
+                                                    default_sufix='[^/]+',
+                                                    converters=converters)
+        if not parts or not tail and not _slashless_re.match(parts[-1][2]):
+            return None
+
+        regex = webapp2._parse_route_template(template,
+                                              default_sufix='[^/]+',
+                                              converters=converters)[0]
+        regex = re.compile(regex.pattern[:-1] + '(/)?$')
+        converters = webapp2._get_template_converters(template, converters)
+        return regex, webapp2._get_route_extractor(regex, converters)
+
     def _get_redirect_route(self, template=None, name=None):
         template = template or self.template
         name = name or self.name
@@ -341,6 +580,27 @@ class RedirectRoute(webapp2.Route):
         return handler.uri_for(kwargs.pop('_name'), *args, **kwargs)
 
 
+def _get_expression_re(char):
+    """Returns a regex for variable expressions that can't match a character:
+    literal word characters, ``\\w``, ``\\d``, classes of word characters and
+    negated classes that include the character, each optionally repeated.
+    """
+    return re.compile(r"""^(?:
+        (?:\[\^[^\]\\]*\\?%s[^\]\\]*\]    # A negated class with the character
+        |\[-?(?:\w-\w|\w)*-?\]            # A class of word characters
+        |\\[wd]                           # \w or \d
+        |[\w-]                            # A literal character
+        )
+        (?:[+*?]|\{\d+(?:,\d*)?\})?\??
+    )*$""" % re.escape(char), re.VERBOSE)
+
+
+#: Regex for variable expressions that can't match a slash.
+_slashless_re = _get_expression_re('/')
+#: Regex for variable expressions that can't match a dot.
+_dotless_re = _get_expression_re('.')
+
+
 def _match_routes(iter_func, request, extra_args=None, extra_kwargs=None):
     """Tries to match a route given an iterator."""
     method_not_allowed = False